@@ -1,18 +1,13 @@
 import streamlit as st
+from collections import OrderedDict
 from datetime import datetime
 
-from tools.ocr import run_ocr
-from tools.asr import transcribe_audio
-from agents.parser_agent import parse_problem
-from agents.intent_router import route_intent
-from agents.solver_agent import SolverAgent
-from agents.verifier_agent import VerifierAgent
-from agents.explainer_agent import ExplainerAgent
-from rag.retriever import Retriever
-from memory.recall_memory import recall_similar
-from memory.solver_bias import extract_solver_bias
+from tools import model_registry
+from tools.ocr import run_ocr, MODEL_NAMES as OCR_MODELS
+from tools.asr import stream_audio, MODEL_NAMES as ASR_MODELS
 from memory.store_hitl import store_hitl_signal
-# from memory.store_memory import store_solved_example
+from pipeline import GanitPipeline
+from worksheet import solve_worksheet
 
 
 # =========================================================
@@ -36,6 +31,11 @@ if "pipeline" not in st.session_state:
 if "run_id" not in st.session_state:
     st.session_state.run_id = datetime.utcnow().isoformat()
 
+# Stage results keyed by a hash of their inputs: widget interactions
+# rerun this script, but only stages whose inputs changed recompute
+if "stage_memo" not in st.session_state:
+    st.session_state.stage_memo = OrderedDict()
+
 # =========================================================
 # BRAND HEADER
 # =========================================================
@@ -54,13 +54,15 @@ st.markdown(
 st.divider()
 
 # =========================================================
-# LOAD RAG (CACHED)
+# LOAD PIPELINE (CACHED)
 # =========================================================
+# Cached for the process lifetime; the pipeline's Retriever swaps in newly
+# published index versions on its own, so re-ingesting needs no restart
 @st.cache_resource
-def load_retriever():
-    return Retriever(top_k=4)
+def load_pipeline():
+    return GanitPipeline(top_k=4)
 
-retriever = load_retriever()
+pipeline = load_pipeline()
 
 # =========================================================
 # STEP 1 — INPUT
@@ -69,31 +71,76 @@ st.subheader("Step 1 · Provide the problem")
 
 input_mode = st.radio(
     "Choose input type",
-    ["🖼️ Image", "🎙️ Audio", "⌨️ Text"],
+    ["🖼️ Image", "🎙️ Audio", "⌨️ Text", "📄 Worksheet"],
     horizontal=True
 )
 
+# Load what this input mode needs in the background while the user
+# uploads or types; text-only sessions never load OCR or ASR models
+model_registry.warm_up(
+    "embedder",
+    *{"🖼️ Image": OCR_MODELS, "📄 Worksheet": OCR_MODELS, "🎙️ Audio": ASR_MODELS}.get(input_mode, ())
+)
+
+with st.sidebar:
+    st.caption("Loaded models")
+    st.json(model_registry.stats())
+
 raw_input = ""
 
 if input_mode == "🖼️ Image":
     uploaded = st.file_uploader("Upload a math problem image", type=["png", "jpg", "jpeg"])
     if uploaded:
         with st.spinner("Extracting text from image…"):
-            with open("temp.png", "wb") as f:
-                f.write(uploaded.getbuffer())
-            ocr = run_ocr("temp.png")
+            ocr = run_ocr(uploaded.getvalue())
         raw_input = st.text_area("Review OCR text", ocr["text"], height=160)
 
 elif input_mode == "🎙️ Audio":
     audio = st.audio_input("Speak your math question")
     if audio:
-        with open("temp.wav", "wb") as f:
-            f.write(audio.getbuffer())
+        # Each speech segment is shown as soon as it is transcribed
+        transcript = st.empty()
         with st.spinner("Transcribing audio…"):
-            asr = transcribe_audio("temp.wav")
-        st.markdown(asr["highlighted_html"], unsafe_allow_html=True)
+            for asr in stream_audio(audio.getvalue()):
+                transcript.markdown(asr["highlighted_html"], unsafe_allow_html=True)
         raw_input = st.text_area("Review transcription", asr["raw_text"], height=140)
 
+elif input_mode == "📄 Worksheet":
+    pages = st.file_uploader(
+        "Upload a worksheet (PDF, or photos in page order)",
+        type=["pdf", "png", "jpg", "jpeg"],
+        accept_multiple_files=True
+    )
+    if pages and st.button("🚀 Solve worksheet", use_container_width=True):
+        progress = st.empty()
+        solved = 0
+
+        # Each problem is shown as soon as it is solved
+        for event in solve_worksheet(pipeline, [page.getvalue() for page in pages]):
+            if event["type"] == "page":
+                progress.caption(f"Read page {event['page']} · {solved} problems solved")
+
+            elif event["type"] == "problem":
+                solved += 1
+                result = event["result"]
+                label = f"Problem {event['number']}" if event["number"] is not None else "Problem"
+                with st.expander(f"{label} · page {event['page']} · {result['status']}"):
+                    st.write(event["text"])
+                    if result["status"] == "ok":
+                        st.markdown(f"**Answer:** {result['explanation']['final_answer']}")
+                        st.progress(result["verifier_output"]["confidence"])
+                    elif result["status"] == "no_context":
+                        st.warning("No relevant knowledge found.")
+                    else:
+                        st.json(result["errors"])
+
+            else:
+                progress.caption(
+                    f"{event['problems']} problems from {event['pages']} pages in {event['seconds']}s · "
+                    f"{event['pages_per_sec']} pages/s · {event['problems_per_sec']} problems/s"
+                )
+    st.stop()
+
 elif input_mode == "⌨️ Text":
     raw_input = st.text_area(
         "Type your math problem",
@@ -108,6 +155,7 @@ st.markdown("###")
 if st.button("🚀 Submit & Analyze", use_container_width=True):
     if raw_input.strip():
         st.session_state.submitted = True
+        st.session_state.run_id = datetime.utcnow().isoformat()
         st.session_state.pipeline = {
             "raw_input": raw_input.strip()
         }
@@ -117,17 +165,32 @@ if st.button("🚀 Submit & Analyze", use_container_width=True):
 if not st.session_state.submitted:
     st.stop()
 
+# =========================================================
+# RUN PIPELINE
+# =========================================================
+with st.spinner("Analyzing, retrieving and solving…"):
+    result = pipeline.run(
+        st.session_state.pipeline["raw_input"],
+        run_id=st.session_state.run_id,
+        memo=st.session_state.stage_memo
+    )
+
+st.session_state.pipeline.update(result)
+
+if result["status"] == "error":
+    st.error("Something went wrong while solving this problem.")
+    with st.expander("Details"):
+        st.json(result["errors"])
+    st.stop()
+
+parsed_problem = result["parsed_problem"]
+
 # =========================================================
 # STEP 2 — PARSER
 # =========================================================
 st.divider()
 st.subheader("Step 2 · Understanding the problem")
 
-with st.spinner("Analyzing problem structure…"):
-    parsed_problem = parse_problem(st.session_state.pipeline["raw_input"])
-
-st.session_state.pipeline["parsed_problem"] = parsed_problem
-
 with st.expander("How GanitAI understands your problem"):
     st.json(parsed_problem)
 
@@ -137,8 +200,7 @@ with st.expander("How GanitAI understands your problem"):
 st.divider()
 st.subheader("Step 3 · Learning from past problems")
 
-similar_memories = recall_similar(parsed_problem["problem_text"])
-memory_bias = extract_solver_bias(similar_memories)
+similar_memories = result["similar_memories"]
 
 if similar_memories:
     st.success("🧠 Similar problem solved earlier — using learned patterns")
@@ -154,14 +216,11 @@ else:
 st.divider()
 st.subheader("Step 4 · Grounding with knowledge")
 
-with st.spinner("Retrieving trusted math knowledge…"):
-    retrieved_chunks = retriever.retrieve(parsed_problem["problem_text"])
-
-if not retrieved_chunks:
+if result["status"] == "no_context":
     st.error("I don’t know. No relevant knowledge found.")
     st.stop()
 
-st.session_state.pipeline["retrieved_chunks"] = retrieved_chunks
+retrieved_chunks = result["retrieved_chunks"]
 
 for i, chunk in enumerate(retrieved_chunks, 1):
     with st.expander(f"Context {i} · {chunk['topic']} · {chunk['difficulty']}"):
@@ -173,26 +232,8 @@ for i, chunk in enumerate(retrieved_chunks, 1):
 st.divider()
 st.subheader("Step 5 · Reasoning & verification")
 
-router = route_intent(parsed_problem)
-
-solver = SolverAgent()
-verifier = VerifierAgent()
-explainer = ExplainerAgent()
-
-with st.spinner("Solving the problem…"):
-    solver_output = solver.solve(
-        parsed_problem=parsed_problem,
-        retrieved_chunks=retrieved_chunks,
-        route_plan=router,
-        memory_bias=memory_bias
-    )
-
-with st.spinner("Verifying correctness…"):
-    verifier_output = verifier.verify(
-        parsed_problem,
-        solver_output,
-        retrieved_chunks
-    )
+solver_output = result["solver_output"]
+verifier_output = result["verifier_output"]
 
 confidence = verifier_output["confidence"]
 st.progress(confidence)
@@ -234,12 +275,7 @@ if verifier_output["needs_human_review"]:
 st.divider()
 st.subheader("Step 6 · Final Answer")
 
-explanation = explainer.explain(
-    parsed_problem,
-    solver_output,
-    verifier_output,
-    retrieved_chunks
-)
+explanation = result["explanation"]
 
 st.markdown(f"### ✅ {explanation['final_answer']}")
 
@@ -251,19 +287,6 @@ st.markdown("#### ⚠️ Common mistakes students make")
 for m in explanation["common_mistakes"]:
     st.write(f"• {m}")
 
-# =========================================================
-# STEP 8 — STORE VERIFIED MEMORY
-# =========================================================
-if confidence >= 0.8:
-    store_solved_example({
-        "original_input": parsed_problem["problem_text"],
-        "parsed_problem": parsed_problem,
-        "retrieved_context": retrieved_chunks,
-        "final_answer": explanation["final_answer"],
-        "verifier_confidence": confidence,
-        "user_feedback": None
-    })
-
 # =========================================================
 # FOOTER (RETENTION)
 # =========================================================
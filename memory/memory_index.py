@@ -0,0 +1,150 @@
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from tools import embedder
+
+MEMORY_PATH = Path("memory/solved_memory.jsonl")
+VECTORS_PATH = Path("memory/solved_memory.vec")
+OFFSETS_PATH = Path("memory/solved_memory.offsets")
+INDEX_META_PATH = Path("memory/solved_memory.index.json")
+
+# Guards appends and rebuilds within one process
+_LOCK = threading.Lock()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype="float32"))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _read_meta():
+    if not INDEX_META_PATH.exists():
+        return None
+    with open(INDEX_META_PATH, "r") as f:
+        return json.load(f)
+
+
+def _write_meta(count: int, dim: int, jsonl_bytes: int):
+    tmp_path = INDEX_META_PATH.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({
+            "model": embedder.vector_key(),
+            "dim": dim,
+            "count": count,
+            "jsonl_bytes": jsonl_bytes
+        }, f)
+    tmp_path.replace(INDEX_META_PATH)
+
+
+def is_stale() -> bool:
+    """
+    The index is stale when it was built for another model, or when the
+    JSONL has been written to without the index being updated.
+    """
+    meta = _read_meta()
+    if meta is None or meta.get("model") != embedder.vector_key():
+        return True
+
+    jsonl_bytes = MEMORY_PATH.stat().st_size if MEMORY_PATH.exists() else 0
+    if meta["jsonl_bytes"] != jsonl_bytes:
+        return True
+
+    if meta["count"] == 0:
+        return False
+
+    expected_vec_bytes = meta["count"] * meta["dim"] * 4
+    expected_off_bytes = meta["count"] * 8
+    return (
+        not VECTORS_PATH.exists()
+        or not OFFSETS_PATH.exists()
+        or VECTORS_PATH.stat().st_size != expected_vec_bytes
+        or OFFSETS_PATH.stat().st_size != expected_off_bytes
+    )
+
+
+def rebuild():
+    """
+    Re-encode every solved example from the JSONL and rewrite the index.
+    """
+    with _LOCK:
+        offsets = []
+        texts = []
+
+        if MEMORY_PATH.exists():
+            with open(MEMORY_PATH, "rb") as f:
+                offset = f.tell()
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        offsets.append(offset)
+                        texts.append(record["original_input"])
+                    offset += len(line)
+            jsonl_bytes = offset
+        else:
+            jsonl_bytes = 0
+
+        vectors = _normalize(embedder.encode_batch(texts))
+
+        vectors.tofile(VECTORS_PATH)
+        np.asarray(offsets, dtype="int64").tofile(OFFSETS_PATH)
+        _write_meta(len(offsets), vectors.shape[1], jsonl_bytes)
+
+
+def ensure_fresh():
+    if is_stale():
+        rebuild()
+
+
+def add_record(offset: int, text: str, jsonl_bytes: int):
+    """
+    Append one solved example that was written at `offset` in the JSONL.
+    If the index was already out of sync, leave it stale for the next
+    recall to rebuild instead of appending misaligned rows.
+    """
+    with _LOCK:
+        meta = _read_meta()
+        if meta is None or meta.get("model") != embedder.vector_key() or meta["jsonl_bytes"] != offset:
+            return
+
+        vector = _normalize(embedder.encode(text))
+
+        with open(VECTORS_PATH, "ab") as f:
+            vector.tofile(f)
+        with open(OFFSETS_PATH, "ab") as f:
+            np.asarray([offset], dtype="int64").tofile(f)
+
+        _write_meta(meta["count"] + 1, vector.shape[1], jsonl_bytes)
+
+
+def read_record(offset: int) -> dict:
+    with open(MEMORY_PATH, "rb") as f:
+        f.seek(offset)
+        return json.loads(f.readline())
+
+
+def search(query_emb, top_k: int = 1):
+    """
+    Cosine nearest-neighbour search over stored examples.
+    Returns a list of (jsonl_offset, similarity), best first.
+    """
+    ensure_fresh()
+
+    meta = _read_meta()
+    if not meta or meta["count"] == 0:
+        return []
+
+    vectors = np.fromfile(VECTORS_PATH, dtype="float32").reshape(meta["count"], meta["dim"])
+    offsets = np.fromfile(OFFSETS_PATH, dtype="int64")
+
+    sims = vectors @ _normalize(query_emb)[0]
+
+    k = min(top_k, len(sims))
+    top = np.argpartition(-sims, k - 1)[:k]
+    top = top[np.argsort(-sims[top])]
+
+    return [(int(offsets[i]), float(sims[i])) for i in top]
@@ -1,13 +1,51 @@
 import json
+import threading
 from datetime import datetime
 from pathlib import Path
 
+from memory import memory_index
+
 MEMORY_PATH = Path("memory/solved_memory.jsonl")
 MEMORY_PATH.parent.mkdir(exist_ok=True)
 
+# run_ids already written, so a rerun of the same run stores nothing
+_STORED_RUNS = None
+_STORED_LOCK = threading.Lock()
+
+
+def _stored_runs() -> set:
+    global _STORED_RUNS
+    if _STORED_RUNS is None:
+        _STORED_RUNS = set()
+        if MEMORY_PATH.exists():
+            with open(MEMORY_PATH, "r") as f:
+                for line in f:
+                    if '"run_id"' in line:
+                        _STORED_RUNS.add(json.loads(line).get("run_id"))
+    return _STORED_RUNS
+
+
+def store_solved_example(payload: dict) -> bool:
+    """
+    Append a verified example. Payloads carrying a `run_id` are written
+    at most once per run; returns False when it was already stored.
+    """
+    run_id = payload.get("run_id")
+
+    with _STORED_LOCK:
+        if run_id is not None and run_id in _stored_runs():
+            return False
+
+        payload["timestamp"] = datetime.utcnow().isoformat()
+
+        with open(MEMORY_PATH, "ab") as f:
+            offset = f.tell()
+            f.write((json.dumps(payload) + "\n").encode("utf-8"))
+            end = f.tell()
 
-def store_solved_example(payload: dict):
-    payload["timestamp"] = datetime.utcnow().isoformat()
+        if run_id is not None:
+            _stored_runs().add(run_id)
 
-    with open(MEMORY_PATH, "a") as f:
-        f.write(json.dumps(payload) + "\n")
+    # Keep the recall index in step with the JSONL
+    memory_index.add_record(offset, payload["original_input"], end)
+    return True
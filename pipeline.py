@@ -0,0 +1,404 @@
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict
+
+import numpy as np
+
+from agents.parser_agent import parse_problem
+from agents.intent_router import route_intent
+from agents.solver_agent import SolverAgent
+from agents.verifier_agent import VerifierAgent
+from agents.explainer_agent import ExplainerAgent
+from rag.retriever import Retriever
+from memory.recall_memory import recall_similar
+from memory.solver_bias import extract_solver_bias
+from memory.store import store_solved_example
+from tools import embedder
+
+# Verified answers at or above this confidence are added to solved memory
+STORE_THRESHOLD = 0.8
+
+# Threads for the extra branches (recall, retrieval, routing) that run
+# beside the calling thread; shared by every run of a pipeline
+STAGE_WORKERS = 4
+
+# Memoized stage results kept per memo (e.g. per Streamlit session)
+MEMO_SIZE = 64
+
+
+class Halt(Exception):
+    """
+    Raised by a stage to end the run early with a non-error status.
+    """
+
+    def __init__(self, status: str):
+        super().__init__(status)
+        self.status = status
+
+
+class Stage:
+    """
+    One pipeline step: `fn(*inputs)` returns the value of `outputs`
+    (a tuple of values when several names are declared).
+    """
+
+    def __init__(self, name: str, fn, inputs, outputs):
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+
+
+def _hash_default(obj):
+    if isinstance(obj, np.ndarray):
+        return hashlib.sha256(obj.tobytes()).hexdigest()
+    return repr(obj)
+
+
+def stage_key(stage: Stage, values: Dict) -> str:
+    """
+    Hash of a stage's name and input values, identifying its result.
+    """
+    payload = json.dumps(
+        [stage.name, [values[name] for name in stage.inputs]],
+        sort_keys=True,
+        default=_hash_default
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def run_stages(stages, values: Dict, executor: ThreadPoolExecutor, memo=None) -> Dict:
+    """
+    Run `stages` as a DAG over `values` (name -> value), starting each
+    stage as soon as all of its inputs exist, so independent branches
+    overlap: one runs on the calling thread, the others on `executor`.
+    A failing stage records its error and every stage that depends on it
+    is skipped; unrelated branches still finish.
+
+    With a `memo` (an OrderedDict, e.g. kept in session state), a stage
+    whose inputs hash the same as on an earlier run reuses that result
+    instead of running again. Errors are never memoized.
+
+    Returns {"status", "errors", "skipped", "cached", "timings_ms"} and
+    fills in `values` with every produced output.
+    """
+    report = {"status": "ok", "errors": {}, "skipped": [], "cached": [], "timings_ms": {}}
+    pending = list(stages)
+    running = {}
+    unavailable = set()
+    keys = {}
+
+    def settle(stage, entry):
+        kind, output = entry
+        if kind == "halt":
+            report["status"] = output
+            unavailable.update(stage.outputs)
+            return
+        if len(stage.outputs) == 1:
+            output = (output,)
+        values.update(zip(stage.outputs, output))
+
+    def timed(stage):
+        t0 = time.perf_counter()
+        try:
+            return stage.fn(*(values[name] for name in stage.inputs))
+        finally:
+            report["timings_ms"][stage.name] = round((time.perf_counter() - t0) * 1000, 2)
+
+    def complete(stage, result):
+        # `result()` returns the stage's output or raises its error
+        try:
+            entry = ("ok", result())
+        except Halt as h:
+            entry = ("halt", h.status)
+        except Exception as e:
+            report["status"] = "error"
+            report["errors"][stage.name] = repr(e)
+            unavailable.update(stage.outputs)
+            return
+
+        if memo is not None:
+            memo[keys[stage.name]] = entry
+            while len(memo) > MEMO_SIZE:
+                memo.popitem(last=False)
+
+        settle(stage, entry)
+
+    while pending or running:
+        # Collect every ready stage; memo hits settle at once and may make
+        # further stages ready, so repeat until nothing changes
+        ready = []
+        progress = True
+        while progress:
+            progress = False
+            for stage in list(pending):
+                halted = report["status"] not in ("ok", "error")
+                if halted or any(name in unavailable for name in stage.inputs):
+                    pending.remove(stage)
+                    report["skipped"].append(stage.name)
+                    unavailable.update(stage.outputs)
+                    progress = True
+
+                elif all(name in values for name in stage.inputs):
+                    pending.remove(stage)
+
+                    if memo is not None:
+                        key = keys[stage.name] = stage_key(stage, values)
+                        if key in memo:
+                            memo.move_to_end(key)
+                            report["cached"].append(stage.name)
+                            settle(stage, memo[key])
+                            progress = True
+                            continue
+
+                    ready.append(stage)
+
+        if ready:
+            # The calling thread runs one stage itself and only the extra
+            # branches go to the shared executor, so concurrent runs (e.g.
+            # one per app session) are not throttled by its size
+            for stage in ready[1:]:
+                running[executor.submit(timed, stage)] = stage
+            complete(ready[0], lambda: timed(ready[0]))
+            done = [future for future in running if future.done()]
+
+        elif running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+        else:
+            # Whatever is left waits on inputs nothing will produce
+            report["skipped"].extend(stage.name for stage in pending)
+            break
+
+        for future in done:
+            complete(running.pop(future), future.result)
+
+    return report
+
+
+class GanitPipeline:
+    """
+    Text problem in, every stage's output out:
+    Parse → (Recall | Retrieve | Route) → Solve → Verify → Explain → Store.
+    Recall, retrieval and routing only depend on the parsed problem and
+    run concurrently. Models and the retriever are loaded once per
+    instance, so one pipeline should be reused for many problems.
+    """
+
+    def __init__(self, retriever: Retriever = None, top_k: int = 4, workers: int = STAGE_WORKERS):
+        self.retriever = retriever or Retriever(top_k=top_k)
+        self.solver = SolverAgent()
+        self.verifier = VerifierAgent()
+        self.explainer = ExplainerAgent()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ganit-stage")
+
+    def stages(self, store: bool = True):
+        stages = [
+            Stage("parse", parse_problem, ["raw_input"], ["parsed_problem"]),
+            # Embed once; shared by memory recall and RAG retrieval
+            Stage("embed", self._embed, ["parsed_problem"], ["problem_emb"]),
+            Stage("recall", self._recall, ["parsed_problem", "problem_emb"], ["similar_memories", "memory_bias"]),
+            Stage(
+                "retrieve", self._retrieve,
+                ["parsed_problem", "problem_emb", "index_version"],
+                ["retrieved_chunks"]
+            ),
+            Stage("route", route_intent, ["parsed_problem"], ["route_plan"]),
+            Stage(
+                "solve", self._solve,
+                ["parsed_problem", "retrieved_chunks", "route_plan", "memory_bias"],
+                ["solver_output"]
+            ),
+            Stage(
+                "verify", self.verifier.verify,
+                ["parsed_problem", "solver_output", "retrieved_chunks"],
+                ["verifier_output"]
+            ),
+            Stage(
+                "explain", self.explainer.explain,
+                ["parsed_problem", "solver_output", "verifier_output", "retrieved_chunks"],
+                ["explanation"]
+            ),
+        ]
+        if store:
+            stages.append(Stage(
+                "store", self._store,
+                ["parsed_problem", "retrieved_chunks", "verifier_output", "explanation", "run_id"],
+                ["stored"]
+            ))
+        return stages
+
+    def _embed(self, parsed_problem):
+        return embedder.encode(parsed_problem["problem_text"])
+
+    def _recall(self, parsed_problem, problem_emb):
+        similar_memories = recall_similar(parsed_problem["problem_text"], query_emb=problem_emb)
+        return similar_memories, extract_solver_bias(similar_memories)
+
+    def _retrieve(self, parsed_problem, problem_emb, index_version):
+        # `index_version` is only an input so memoized results expire
+        # when a new index is published
+        retrieved_chunks = self.retriever.retrieve(
+            parsed_problem["problem_text"],
+            query_emb=problem_emb,
+            topic=parsed_problem["topic"]
+        )
+        if not retrieved_chunks:
+            raise Halt("no_context")
+        return retrieved_chunks
+
+    def _solve(self, parsed_problem, retrieved_chunks, route_plan, memory_bias):
+        return self.solver.solve(
+            parsed_problem=parsed_problem,
+            retrieved_chunks=retrieved_chunks,
+            route_plan=route_plan,
+            memory_bias=memory_bias
+        )
+
+    def _store(self, parsed_problem, retrieved_chunks, verifier_output, explanation, run_id):
+        if verifier_output["confidence"] < STORE_THRESHOLD:
+            return False
+
+        return store_solved_example({
+            "run_id": run_id,
+            "original_input": parsed_problem["problem_text"],
+            "parsed_problem": parsed_problem,
+            "retrieved_context": retrieved_chunks,
+            "final_answer": explanation["final_answer"],
+            "verifier_confidence": verifier_output["confidence"],
+            "user_feedback": None
+        })
+
+    def run(self, text: str, store: bool = True, run_id: str = None, memo: OrderedDict = None) -> Dict:
+        """
+        Returns a dict with the output of each stage that ran, plus
+        `status` ("ok", "no_context" or "error"), per-stage `errors`,
+        `skipped` and `cached` stages and `timings_ms`.
+
+        With `store`, confidently verified answers are written to solved
+        memory, at most once per `run_id`. Passing the same `memo` across
+        calls (see run_stages) only recomputes stages whose inputs changed.
+        """
+        values = {
+            "raw_input": text.strip(),
+            "index_version": self.retriever.version,
+            "run_id": run_id,
+            "stored": False
+        }
+
+        t0 = time.perf_counter()
+        report = run_stages(self.stages(store), values, self.executor, memo)
+        report["timings_ms"]["total"] = round((time.perf_counter() - t0) * 1000, 2)
+
+        values.pop("problem_emb", None)
+        values["retrieved_chunks"] = values.get("retrieved_chunks", [])
+        return {**values, **report}
+
+
+# ---------------------------------------------------------
+# Batch solving: one pipeline per worker process
+# ---------------------------------------------------------
+_WORKER_PIPELINE = None
+_WORKER_STORE = False
+
+
+def _init_worker(top_k: int, store: bool):
+    global _WORKER_PIPELINE, _WORKER_STORE
+    # No background reloads in a short-lived batch worker
+    _WORKER_PIPELINE = GanitPipeline(Retriever(top_k=top_k, auto_reload=False))
+    _WORKER_STORE = store
+
+
+def _solve_line(line: str) -> str:
+    record = None
+    text = line.strip()
+
+    t0 = time.perf_counter()
+    try:
+        # A malformed line fails like a problem would, without ending the batch
+        record = json.loads(line)
+        text = record["problem"] if isinstance(record, dict) else record
+        result = _WORKER_PIPELINE.run(text, store=_WORKER_STORE)
+    except Exception as e:
+        result = {"raw_input": text, "status": "error", "error": repr(e)}
+    result["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+    if isinstance(record, dict) and "id" in record:
+        result["id"] = record["id"]
+
+    return json.dumps(result)
+
+
+def iter_problem_lines(path: str):
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+def solve_file(
+    input_path: str,
+    output_path: str,
+    workers: int = 4,
+    top_k: int = 4,
+    store: bool = False,
+    chunksize: int = 8
+):
+    """
+    Stream a JSONL file of problems (`{"id": ..., "problem": "..."}` or bare
+    strings) through a process pool, writing one JSON result per line in
+    input order as soon as it is ready.
+    """
+    from multiprocessing import Pool
+
+    t0 = time.perf_counter()
+    first_result = None
+    solved = 0
+    statuses = {}
+
+    with Pool(workers, initializer=_init_worker, initargs=(top_k, store)) as pool, \
+            open(output_path, "w") as out:
+        for line in pool.imap(_solve_line, iter_problem_lines(input_path), chunksize=chunksize):
+            out.write(line + "\n")
+            out.flush()
+
+            if first_result is None:
+                # Includes worker startup (loading models and the index)
+                first_result = time.perf_counter() - t0
+
+            solved += 1
+            status = json.loads(line)["status"]
+            statuses[status] = statuses.get(status, 0) + 1
+
+    elapsed = time.perf_counter() - t0
+    print(
+        f"{solved} problems in {elapsed:.1f}s "
+        f"({solved / elapsed:.1f} problems/s, {workers} workers, first result after {first_result or 0.0:.1f}s)"
+    )
+    print("Statuses: " + ", ".join(f"{k}={v}" for k, v in sorted(statuses.items())))
+
+
+if __name__ == "__main__":
+    import os
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Solve a JSONL file of problems with the GanitAI pipeline")
+    parser.add_argument("input", help='JSONL of {"id": ..., "problem": "..."} or bare strings')
+    parser.add_argument("-o", "--output", default="results.jsonl")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--chunksize", type=int, default=8)
+    parser.add_argument("--store", action="store_true", help="add verified answers to solved memory")
+    args = parser.parse_args()
+
+    solve_file(
+        args.input,
+        args.output,
+        workers=args.workers,
+        top_k=args.top_k,
+        store=args.store,
+        chunksize=args.chunksize
+    )
@@ -0,0 +1,96 @@
+import os
+import json
+import mmap
+
+import numpy as np
+
+
+def write_chunk_store(chunks, blob_path: str, offsets_path: str):
+    """
+    Pack chunk dicts (each with an "id") into a blob of compact JSON records
+    and an int64 (start, length) table indexed by chunk id. Ids that are not
+    present get length 0.
+    """
+    spans = {}
+
+    with open(blob_path + ".tmp", "wb") as f:
+        for chunk in chunks:
+            record = json.dumps(chunk, separators=(",", ":")).encode("utf-8")
+            spans[chunk["id"]] = (f.tell(), len(record))
+            f.write(record)
+
+    table = np.zeros((max(spans, default=-1) + 1, 2), dtype="int64")
+    for chunk_id, span in spans.items():
+        table[chunk_id] = span
+    table.tofile(offsets_path + ".tmp")
+
+    os.replace(blob_path + ".tmp", blob_path)
+    os.replace(offsets_path + ".tmp", offsets_path)
+
+
+def write_topic_partitions(chunks, path: str):
+    """
+    Save the sorted chunk ids of each topic, for topic-filtered search.
+    """
+    partitions = {}
+    for chunk in chunks:
+        partitions.setdefault(chunk["topic"], []).append(chunk["id"])
+
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **{
+        topic: np.asarray(sorted(ids), dtype="int64")
+        for topic, ids in partitions.items()
+    })
+    os.replace(tmp_path, path)
+
+
+def read_topic_partitions(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with np.load(path) as partitions:
+        return {topic: partitions[topic] for topic in partitions.files}
+
+
+def chunk_store_exists(blob_path: str, offsets_path: str) -> bool:
+    return os.path.exists(blob_path) and os.path.exists(offsets_path)
+
+
+class ChunkStore:
+    """
+    Read-only, memory-mapped view of the packed chunk store. Records are
+    decoded lazily by id, and the mapped pages are shared between worker
+    processes through the OS page cache.
+    """
+
+    def __init__(self, blob_path: str, offsets_path: str):
+        rows = os.path.getsize(offsets_path) // 16
+        self.table = (
+            np.memmap(offsets_path, dtype="int64", mode="r", shape=(rows, 2))
+            if rows else np.zeros((0, 2), dtype="int64")
+        )
+
+        self._file = open(blob_path, "rb")
+        self.blob = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if os.path.getsize(blob_path) else b""
+        )
+
+    def __contains__(self, chunk_id) -> bool:
+        return 0 <= chunk_id < len(self.table) and self.table[chunk_id, 1] > 0
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.table[:, 1]))
+
+    def get(self, chunk_id):
+        if chunk_id not in self:
+            return None
+        start, length = self.table[chunk_id]
+        return json.loads(self.blob[start:start + length])
+
+    def ids(self):
+        return np.flatnonzero(self.table[:, 1])
+
+    def close(self):
+        if isinstance(self.blob, mmap.mmap):
+            self.blob.close()
+        self._file.close()
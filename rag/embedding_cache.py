@@ -0,0 +1,122 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+
+CACHE_VEC_PATH = "rag/embedding_cache.vec"
+CACHE_KEYS_PATH = "rag/embedding_cache.json"
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Append-only on-disk map from chunk content hash to embedding.
+    Vectors live in a flat float32 file; the JSON file maps hash -> row.
+    `compact` drops the vectors of chunks that no longer exist.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        dim: int,
+        vec_path: str = CACHE_VEC_PATH,
+        keys_path: str = CACHE_KEYS_PATH
+    ):
+        self.model_name = model_name
+        self.dim = dim
+        self.vec_path = vec_path
+        self.keys_path = keys_path
+        self.rows = {}
+
+        if os.path.exists(keys_path) and os.path.exists(vec_path):
+            with open(keys_path, "r") as f:
+                saved = json.load(f)
+            if saved.get("model") == model_name and saved.get("dim") == dim:
+                self.rows = saved["rows"]
+
+        self._repair()
+
+    def _repair(self):
+        # A crash between appending vectors and saving keys leaves extra rows
+        row_bytes = self.dim * 4
+        on_disk = os.path.getsize(self.vec_path) // row_bytes if os.path.exists(self.vec_path) else 0
+
+        if on_disk < len(self.rows):
+            self.rows = {}
+            on_disk = 0
+            open(self.vec_path, "wb").close()
+        elif on_disk > len(self.rows):
+            with open(self.vec_path, "r+b") as f:
+                f.truncate(len(self.rows) * row_bytes)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def get_many(self, keys):
+        """
+        Returns {hash: embedding} for the keys that are cached.
+        """
+        hits = [k for k in keys if k in self.rows]
+        if not hits:
+            return {}
+
+        vectors = np.memmap(
+            self.vec_path, dtype="float32", mode="r",
+            shape=(len(self.rows), self.dim)
+        )
+        return {k: np.array(vectors[self.rows[k]]) for k in hits}
+
+    def put_many(self, keys, embeddings):
+        with open(self.vec_path, "ab") as f:
+            for key, emb in zip(keys, embeddings):
+                # Checked per key: a batch may repeat a hash (duplicate files)
+                if key in self.rows:
+                    continue
+                self.rows[key] = len(self.rows)
+                np.asarray(emb, dtype="float32").tofile(f)
+
+    def compact(self, keep, block_rows: int = 4096):
+        """
+        Rewrite the cache with only the hashes in `keep`, and save it.
+        Returns the number of vectors dropped.
+        """
+        keep = set(keep)
+        live = sorted((row, key) for key, row in self.rows.items() if key in keep)
+        dropped = len(self.rows) - len(live)
+        if not dropped:
+            return 0
+
+        vectors = np.memmap(
+            self.vec_path, dtype="float32", mode="r",
+            shape=(len(self.rows), self.dim)
+        )
+        tmp_path = self.vec_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for start in range(0, len(live), block_rows):
+                rows = [row for row, _ in live[start:start + block_rows]]
+                np.ascontiguousarray(vectors[rows]).tofile(f)
+        del vectors
+
+        # Vectors first: a crash before the keys are saved leaves fewer rows
+        # on disk than keys, which _repair treats as an empty cache
+        os.replace(tmp_path, self.vec_path)
+        self.rows = {key: i for i, (_, key) in enumerate(live)}
+        self.save()
+        return dropped
+
+    def save(self):
+        tmp_path = self.keys_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "model": self.model_name,
+                "dim": self.dim,
+                "rows": self.rows
+            }, f)
+        os.replace(tmp_path, self.keys_path)
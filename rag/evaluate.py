@@ -0,0 +1,110 @@
+import json
+import time
+import argparse
+
+import numpy as np
+
+from rag.embedding_cache import EmbeddingCache
+from rag.index_factory import build_index, index_spec, prepare_vectors, read_index_meta, set_search_params
+from rag.ingest import iter_cached_vectors, manifest_entries
+from rag.retriever import read_index
+from rag.versions import current_paths
+from tools import embedder
+
+
+def load_corpus(paths):
+    """
+    Returns (ids, vectors) for every indexed chunk, from the embedding cache.
+    """
+    with open(paths.manifest, "r") as f:
+        manifest = json.load(f)
+    with open(paths.metadata, "r") as f:
+        metadata = {chunk["id"]: chunk for chunk in json.load(f)}
+
+    cache = EmbeddingCache(embedder.vector_key(), embedder.dimension())
+    ids, vectors = [], []
+    for batch_ids, batch_vectors in iter_cached_vectors(manifest_entries(manifest), cache, metadata, 4096):
+        ids.append(batch_ids)
+        vectors.append(batch_vectors)
+    cache.save()
+
+    return np.concatenate(ids), np.vstack(vectors)
+
+
+def timed_search(index, queries: np.ndarray, k: int):
+    """
+    One query at a time, as the app issues them. Returns (labels, latencies_ms).
+    """
+    labels = np.empty((len(queries), k), dtype="int64")
+    latencies = np.empty(len(queries))
+
+    for i in range(len(queries)):
+        t0 = time.perf_counter()
+        _, labels[i] = index.search(queries[i:i + 1], k)
+        latencies[i] = (time.perf_counter() - t0) * 1000
+
+    return labels, latencies
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def evaluate(k: int = 4, num_queries: int = 200, queries_path: str = None, sweep=None):
+    paths = current_paths()
+    spec = read_index_meta(paths.index_meta)
+    ids, corpus = load_corpus(paths)
+
+    if queries_path:
+        with open(queries_path, "r") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        queries = embedder.encode_batch(texts)
+    else:
+        rng = np.random.default_rng(0)
+        queries = corpus[rng.choice(len(corpus), size=min(num_queries, len(corpus)), replace=False)]
+    queries = prepare_vectors(queries, spec)
+
+    # Exact baseline under the same metric as the index being evaluated
+    baseline_spec = index_spec("flat_ip" if spec["metric"] == "ip" else "flat_l2")
+    baseline = build_index(baseline_spec, corpus.shape[1])
+    baseline.add_with_ids(prepare_vectors(corpus, baseline_spec), ids)
+    truth, base_lat = timed_search(baseline, queries, k)
+
+    print(f"{len(ids)} chunks · {len(queries)} queries · k={k} · index={spec['index_type']}")
+    print(f"{'setting':<18}{'recall@k':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    print(f"{'exact baseline':<18}{1.0:>10.3f}{np.percentile(base_lat, 50):>10.3f}{np.percentile(base_lat, 99):>10.3f}")
+
+    index = read_index(paths.index)
+
+    knob = {"hnsw": "ef_search", "ivf": "nprobe", "ivfpq": "nprobe"}.get(spec["index_type"])
+    settings = sweep if knob and sweep else [None]
+
+    for value in settings:
+        if knob:
+            set_search_params(index, spec, **{knob: value})
+        label = f"{knob}={value}" if value else spec["index_type"]
+
+        found, lat = timed_search(index, queries, k)
+        print(
+            f"{label:<18}{recall_at_k(found, truth):>10.3f}"
+            f"{np.percentile(lat, 50):>10.3f}{np.percentile(lat, 99):>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recall@k and query latency of the built index against exact search"
+    )
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--num-queries", type=int, default=200, help="corpus vectors sampled as queries")
+    parser.add_argument("--queries", help="file with one query per line, instead of sampling the corpus")
+    parser.add_argument("--sweep", type=int, nargs="+", help="nprobe / efSearch values to try")
+    args = parser.parse_args()
+
+    evaluate(
+        k=args.k,
+        num_queries=args.num_queries,
+        queries_path=args.queries,
+        sweep=args.sweep
+    )
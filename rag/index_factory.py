@@ -0,0 +1,143 @@
+import os
+import json
+
+import faiss
+import numpy as np
+
+# index_type -> (metric, normalize vectors, needs training, supports remove_ids)
+INDEX_TYPES = {
+    "flat_l2": ("l2", False, False, True),
+    "flat_ip": ("ip", True, False, True),
+    "hnsw": ("ip", True, False, False),
+    "ivf": ("ip", True, True, True),
+    "ivfpq": ("ip", True, True, True),
+}
+
+DEFAULT_PARAMS = {
+    "hnsw_m": 32,
+    "ef_construction": 200,
+    "nlist": 1024,
+    "pq_m": 48,  # sub-quantizers; must divide the embedding dimension
+    "pq_nbits": 8,
+}
+
+DEFAULT_SEARCH = {
+    "nprobe": 16,
+    "ef_search": 64,
+}
+
+
+def index_spec(index_type: str, params: dict = None, search: dict = None) -> dict:
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Choose from {sorted(INDEX_TYPES)}")
+
+    metric, normalize, trainable, removable = INDEX_TYPES[index_type]
+    return {
+        "index_type": index_type,
+        "metric": metric,
+        "normalize": normalize,
+        "trainable": trainable,
+        "removable": removable,
+        "params": {**DEFAULT_PARAMS, **(params or {})},
+        "search": {**DEFAULT_SEARCH, **(search or {})},
+    }
+
+
+def prepare_vectors(vectors, spec: dict) -> np.ndarray:
+    vectors = np.ascontiguousarray(np.atleast_2d(vectors), dtype="float32")
+    if spec["normalize"]:
+        vectors = vectors.copy()
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def build_index(spec: dict, dim: int, train_vectors=None):
+    """
+    Create an empty id-mapped index of the given spec. Trainable types
+    are trained on `train_vectors` (already prepared).
+    """
+    index_type = spec["index_type"]
+    params = spec["params"]
+    metric = faiss.METRIC_INNER_PRODUCT if spec["metric"] == "ip" else faiss.METRIC_L2
+
+    if index_type == "flat_l2":
+        base = faiss.IndexFlatL2(dim)
+
+    elif index_type == "flat_ip":
+        base = faiss.IndexFlatIP(dim)
+
+    elif index_type == "hnsw":
+        base = faiss.IndexHNSWFlat(dim, params["hnsw_m"], metric)
+        base.hnsw.efConstruction = params["ef_construction"]
+
+    else:
+        if train_vectors is None or len(train_vectors) == 0:
+            raise ValueError(f"'{index_type}' index needs training vectors")
+
+        # Keep at least ~39 training points per list, as faiss recommends
+        nlist = max(1, min(params["nlist"], len(train_vectors) // 39))
+        quantizer = faiss.IndexFlatIP(dim) if metric == faiss.METRIC_INNER_PRODUCT else faiss.IndexFlatL2(dim)
+
+        if index_type == "ivf":
+            base = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+        else:
+            if dim % params["pq_m"]:
+                raise ValueError(f"pq_m={params['pq_m']} must divide the dimension {dim}")
+            if len(train_vectors) < 2 ** params["pq_nbits"]:
+                raise ValueError(
+                    f"ivfpq needs at least {2 ** params['pq_nbits']} training vectors, "
+                    f"got {len(train_vectors)}; use 'ivf' or a flat index for small corpora"
+                )
+            base = faiss.IndexIVFPQ(quantizer, dim, nlist, params["pq_m"], params["pq_nbits"], metric)
+
+        base.train(train_vectors)
+
+    return faiss.IndexIDMap(base)
+
+
+def set_search_params(index, spec: dict, nprobe: int = None, ef_search: int = None):
+    """
+    Apply query-time knobs. Arguments override the values recorded at build time.
+    """
+    search = spec["search"]
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+
+    if spec["index_type"] == "hnsw":
+        base.hnsw.efSearch = ef_search or search["ef_search"]
+
+    elif spec["index_type"] in ("ivf", "ivfpq"):
+        faiss.extract_index_ivf(base).nprobe = nprobe or search["nprobe"]
+
+
+def filtered_search_params(index, spec: dict, sel):
+    """
+    SearchParameters restricting a search to the ids accepted by `sel`,
+    carrying over the index's current nprobe / efSearch. faiss requires
+    the parameter class to match the wrapped index family.
+    """
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+
+    if spec["index_type"] == "hnsw":
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=base.hnsw.efSearch)
+
+    if spec["index_type"] in ("ivf", "ivfpq"):
+        return faiss.SearchParametersIVF(sel=sel, nprobe=faiss.extract_index_ivf(base).nprobe)
+
+    return faiss.SearchParameters(sel=sel)
+
+
+def write_index_meta(spec: dict, path: str):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(spec, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_index_meta(path: str) -> dict:
+    """
+    Builds that predate index_meta.json are plain flat L2 indexes.
+    """
+    if not os.path.exists(path):
+        return index_spec("flat_l2")
+    with open(path, "r") as f:
+        return json.load(f)
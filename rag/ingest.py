@@ -1,25 +1,43 @@
 import os
+import sys
 import json
-from sentence_transformers import SentenceTransformer
+import time
+import argparse
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
 import faiss
+import numpy as np
+
+from rag.chunk_store import write_chunk_store, write_topic_partitions
+from rag.embedding_cache import EmbeddingCache, content_hash
+from rag.index_factory import (
+    INDEX_TYPES, build_index, index_spec, prepare_vectors, read_index_meta, write_index_meta
+)
+from rag.lexical import LexicalIndex
+from rag.versions import IndexPaths, current_paths, new_version, prune, publish
+from tools import embedder
 
 KB_DIR = "rag/kb_docs"
-INDEX_PATH = "rag/faiss.index"
-META_PATH = "rag/metadata.json"
 
 CHUNK_SIZE = 300  # characters
-MODEL_NAME = "all-MiniLM-L6-v2"
+BATCH_SIZE = 64  # chunks per forward pass
+FLUSH_SIZE = 1024  # embeddings buffered before adding to FAISS
+NUM_WORKERS = 4  # file reading + chunking threads
+TRAIN_SIZE = 100_000  # vectors sampled to train IVF / PQ
 
 
 def infer_topic_from_filename(filename: str) -> str:
+    # "linear" first: linear_algebra_* files also contain "algebra"
+    if "linear" in filename:
+        return "linear_algebra"
     if "algebra" in filename:
         return "algebra"
     if "calculus" in filename:
         return "calculus"
     if "probability" in filename:
         return "probability"
-    if "linear" in filename:
-        return "linear_algebra"
     return "general"
 
 
@@ -38,46 +56,455 @@ def chunk_text(text: str):
     return chunks
 
 
-def ingest():
-    model = SentenceTransformer(MODEL_NAME)
+def peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0.0
 
-    embeddings = []
-    metadata = []
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
 
-    for filename in os.listdir(KB_DIR):
-        if not filename.endswith(".md"):
-            continue
 
-        path = os.path.join(KB_DIR, filename)
-        with open(path, "r") as f:
-            content = f.read()
+def list_kb_files(kb_dir: str = KB_DIR):
+    return sorted(
+        filename for filename in os.listdir(kb_dir)
+        if filename.endswith(".md")
+    )
+
 
-        topic = infer_topic_from_filename(filename)
-        chunks = chunk_text(content)
+def load_file(filename: str, kb_dir: str = KB_DIR):
+    """
+    Read one KB file, hash it and split it into metadata-tagged chunks.
+    """
+    path = os.path.join(kb_dir, filename)
+    with open(path, "r") as f:
+        content = f.read()
 
-        for chunk in chunks:
-            emb = model.encode(chunk)
-            embeddings.append(emb)
+    topic = infer_topic_from_filename(filename)
 
-            metadata.append({
+    return {
+        "filename": filename,
+        "hash": content_hash(content),
+        "chunks": [
+            {
                 "text": chunk,
                 "source": filename,
                 "topic": topic,
                 "difficulty": infer_difficulty(chunk)
-            })
+            }
+            for chunk in chunk_text(content)
+        ]
+    }
+
+
+def iter_files(filenames, kb_dir: str = KB_DIR, workers: int = NUM_WORKERS):
+    """
+    Read and chunk files on a worker pool, yielding them in order.
+    At most `2 * workers` files are in flight so memory stays bounded.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        files = iter(filenames)
+        pending = deque(
+            pool.submit(load_file, filename, kb_dir)
+            for filename in islice(files, 2 * workers)
+        )
+
+        while pending:
+            loaded = pending.popleft().result()
+
+            filename = next(files, None)
+            if filename is not None:
+                pending.append(pool.submit(load_file, filename, kb_dir))
+
+            yield loaded
+
+
+class JsonArrayWriter:
+    """
+    Writes a JSON array one element at a time instead of
+    holding the whole list in memory.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def __enter__(self):
+        self.f.write("[")
+        return self
+
+    def write(self, item):
+        if self.count:
+            self.f.write(",\n")
+        json.dump(item, self.f)
+        self.count += 1
+
+    def __exit__(self, *exc):
+        self.f.write("]\n")
+
+
+def new_manifest():
+    return {
+        "model": embedder.vector_key(),
+        "chunk_size": CHUNK_SIZE,
+        "next_id": 0,
+        "files": {}
+    }
+
+
+def load_previous_build(paths: IndexPaths):
+    """
+    Returns (manifest, index, metadata, spec) of the build in `paths`, or
+    None when anything is missing or inconsistent and a full build is needed.
+    """
+    if not all(os.path.exists(p) for p in (paths.manifest, paths.index, paths.metadata)):
+        return None
+
+    with open(paths.manifest, "r") as f:
+        manifest = json.load(f)
+
+    if manifest.get("model") != embedder.vector_key() or manifest.get("chunk_size") != CHUNK_SIZE:
+        return None
+
+    expected = sum(len(entry["chunks"]) for entry in manifest["files"].values())
+
+    index = faiss.read_index(paths.index)
+    if index.ntotal != expected:
+        return None
+
+    with open(paths.metadata, "r") as f:
+        metadata = {chunk["id"]: chunk for chunk in json.load(f) if "id" in chunk}
+    if len(metadata) != expected:
+        return None
+
+    return manifest, index, metadata, read_index_meta(paths.index_meta)
+
+
+def write_json_atomic(path: str, obj):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def manifest_entries(manifest):
+    return [(c["id"], c["hash"]) for f in manifest["files"].values() for c in f["chunks"]]
+
+
+def iter_cached_vectors(entries, cache: EmbeddingCache, metadata: dict, batch_size: int):
+    """
+    Yield (ids, embeddings) for (chunk_id, chunk_hash) entries, read back
+    from the embedding cache in batches. Anything missing from the cache
+    (e.g. it was deleted) is re-embedded from the chunk text.
+    """
+    for i in range(0, len(entries), batch_size):
+        part = entries[i:i + batch_size]
+        vectors = cache.get_many([h for _, h in part])
+
+        # One entry per hash: identical chunks are embedded once
+        misses = list({h: (chunk_id, h) for chunk_id, h in part if h not in vectors}.values())
+        if misses:
+            embs = embedder.encode_batch([metadata[chunk_id]["text"] for chunk_id, _ in misses])
+            cache.put_many([h for _, h in misses], embs)
+            vectors.update({h: emb for (_, h), emb in zip(misses, embs)})
+
+        yield (
+            np.asarray([chunk_id for chunk_id, _ in part], dtype="int64"),
+            np.vstack([vectors[h] for _, h in part])
+        )
+
+
+def build_from_cache(manifest, metadata: dict, cache: EmbeddingCache, spec: dict, dim: int, flush_size: int):
+    """
+    Build a fresh index of `spec` from cached embeddings. Used for trainable
+    index types, index-type changes, and removals on indexes (HNSW) that
+    cannot delete entries.
+    """
+    entries = manifest_entries(manifest)
+
+    train_vectors = None
+    if spec["trainable"] and entries:
+        rng = np.random.default_rng(0)
+        sample = rng.choice(len(entries), size=min(TRAIN_SIZE, len(entries)), replace=False)
+        train_entries = [entries[i] for i in sorted(sample)]
+        train_vectors = prepare_vectors(
+            np.vstack([embs for _, embs in iter_cached_vectors(train_entries, cache, metadata, flush_size)]),
+            spec
+        )
+
+    index = build_index(spec, dim, train_vectors)
 
-    dim = len(embeddings[0])
-    index = faiss.IndexFlatL2(dim)
-    index.add(np.array(embeddings).astype("float32"))
+    for ids, embs in iter_cached_vectors(entries, cache, metadata, flush_size):
+        index.add_with_ids(prepare_vectors(embs, spec), ids)
+        print(f"  {index.ntotal}/{len(entries)} chunks indexed from cache · peak RSS {peak_rss_mb():.0f} MB")
 
-    faiss.write_index(index, INDEX_PATH)
+    return index
 
-    with open(META_PATH, "w") as f:
-        json.dump(metadata, f, indent=2)
 
-    print(f"Ingested {len(metadata)} chunks into FAISS")
+def ingest(
+    batch_size: int = BATCH_SIZE,
+    flush_size: int = FLUSH_SIZE,
+    workers: int = NUM_WORKERS,
+    full: bool = False,
+    index_type: str = None,
+    params: dict = None,
+    search: dict = None
+):
+    """
+    Bring the FAISS index in line with KB_DIR. Only new or edited chunks
+    are embedded (or pulled from the embedding cache); chunks of deleted
+    files, and chunks that disappeared from edited files, are removed by id.
+    `index_type` defaults to whatever the previous build used.
+
+    Every build that changes anything is written to a new version
+    directory and then published, so running apps can swap to it.
+    """
+    start = time.perf_counter()
+    dim = embedder.dimension()
+
+    previous_paths = current_paths()
+    recorded = read_index_meta(previous_paths.index_meta)
+    if index_type is None:
+        index_type = recorded["index_type"]
+        params = params or recorded["params"]
+        search = search or recorded["search"]
+    spec = index_spec(index_type, params, search)
+
+    previous = None if full else load_previous_build(previous_paths)
+    if previous is None:
+        manifest = new_manifest()
+        index = None
+        metadata = {}
+        print(f"Full build ({index_type})")
+    else:
+        manifest, index, metadata, previous_spec = previous
+        if (previous_spec["index_type"], previous_spec["params"]) != (spec["index_type"], spec["params"]):
+            print(f"Index changed {previous_spec['index_type']} -> {index_type}; rebuilding from cache")
+            index = None
+        else:
+            print(f"Incremental build ({index_type})")
+
+    # A fresh build can stream into an empty index unless it needs training
+    # first; an index-type change is rebuilt from cache after the KB scan
+    if previous is None and not spec["trainable"]:
+        index = build_index(spec, dim)
+    rebuild = index is None
+
+    cache = EmbeddingCache(embedder.vector_key(), dim)
+    files = manifest["files"]
+    stats = {
+        "files_changed": 0,
+        "files_deleted": 0,
+        "chunks_kept": 0,
+        "chunks_from_cache": 0,
+        "chunks_embedded": 0
+    }
+
+    filenames = list_kb_files()
+    stale_ids = []
+
+    for filename in [f for f in files if f not in filenames]:
+        stale_ids.extend(c["id"] for c in files.pop(filename)["chunks"])
+        stats["files_deleted"] += 1
+
+    # Cheap stat check first; only files that look touched are read and hashed
+    file_stats = {}
+    to_read = []
+    for filename in filenames:
+        st = os.stat(os.path.join(KB_DIR, filename))
+        file_stats[filename] = st
+        entry = files.get(filename)
+        if not entry or entry["size"] != st.st_size or entry["mtime_ns"] != st.st_mtime_ns:
+            to_read.append(filename)
+
+    pending = []  # (chunk_hash, chunk) awaiting embeddings
+    buffer_ids = []
+    buffer_embs = []
+
+    def flush():
+        if buffer_ids:
+            index.add_with_ids(
+                prepare_vectors(np.vstack(buffer_embs), spec),
+                np.asarray(buffer_ids, dtype="int64")
+            )
+            buffer_ids.clear()
+            buffer_embs.clear()
+
+        elapsed = time.perf_counter() - start
+        added = stats["chunks_from_cache"] + stats["chunks_embedded"]
+        print(
+            f"  {added} chunks added · {added / elapsed if elapsed else 0.0:.1f} chunks/sec · "
+            f"peak RSS {peak_rss_mb():.0f} MB"
+        )
+
+    def embed_pending():
+        if not pending:
+            return
+
+        hashes = [h for h, _ in pending]
+        cached = cache.get_many(hashes)
+        # One entry per hash: identical chunks are embedded once
+        misses = list({h: (h, chunk) for h, chunk in pending if h not in cached}.values())
+
+        if misses:
+            embs = embedder.encode_batch([chunk["text"] for _, chunk in misses], batch_size=batch_size)
+            cache.put_many([h for h, _ in misses], embs)
+            cached.update({h: emb for (h, _), emb in zip(misses, embs)})
+
+        stats["chunks_embedded"] += len(misses)
+        stats["chunks_from_cache"] += len(pending) - len(misses)
+
+        for h, chunk in pending:
+            metadata[chunk["id"]] = chunk
+            if not rebuild:
+                buffer_ids.append(chunk["id"])
+                buffer_embs.append(cached[h])
+        pending.clear()
+
+        if len(buffer_ids) >= flush_size:
+            flush()
+
+    for loaded in iter_files(to_read, workers=workers):
+        filename = loaded["filename"]
+        st = file_stats[filename]
+        entry = files.get(filename)
+
+        if entry and entry["hash"] == loaded["hash"]:
+            # Touched but not edited
+            entry["size"], entry["mtime_ns"] = st.st_size, st.st_mtime_ns
+            continue
+
+        stats["files_changed"] += 1
+
+        # Chunks whose text survived the edit keep their id and index entry
+        reusable = {}
+        for c in (entry["chunks"] if entry else []):
+            reusable.setdefault(c["hash"], []).append(c["id"])
+
+        chunk_entries = []
+        for chunk in loaded["chunks"]:
+            h = content_hash(chunk["text"])
+
+            if reusable.get(h):
+                chunk_id = reusable[h].pop(0)
+                stats["chunks_kept"] += 1
+            else:
+                chunk_id = manifest["next_id"]
+                manifest["next_id"] += 1
+                chunk["id"] = chunk_id
+                pending.append((h, chunk))
+                if len(pending) >= batch_size:
+                    embed_pending()
+
+            chunk_entries.append({"id": chunk_id, "hash": h})
+
+        stale_ids.extend(i for ids in reusable.values() for i in ids)
+
+        files[filename] = {
+            "hash": loaded["hash"],
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "chunks": chunk_entries
+        }
+
+    embed_pending()
+    if not rebuild:
+        flush()
+
+    for chunk_id in stale_ids:
+        metadata.pop(chunk_id, None)
+
+    if stale_ids and not rebuild:
+        if spec["removable"]:
+            index.remove_ids(np.asarray(stale_ids, dtype="int64"))
+        else:
+            print(f"{index_type} cannot delete entries; rebuilding from cache")
+            rebuild = True
+
+    if rebuild:
+        index = build_from_cache(manifest, metadata, cache, spec, dim, flush_size)
+
+    cache.save()
+    # Drop the vectors of edited and deleted chunks, or the cache only grows
+    dropped = cache.compact(chunk_hash for _, chunk_hash in manifest_entries(manifest))
+    if dropped:
+        print(f"Dropped {dropped} unused vectors from the embedding cache")
+
+    changed = (
+        stats["files_changed"] or stats["files_deleted"] or rebuild
+        or previous is None or previous_spec != spec
+    )
+
+    if changed:
+        version, paths = new_version()
+
+        faiss.write_index(index, paths.index)
+
+        with open(paths.metadata, "w") as f, JsonArrayWriter(f) as meta_writer:
+            for chunk_id in sorted(metadata):
+                meta_writer.write(metadata[chunk_id])
+
+        write_chunk_store(
+            (metadata[chunk_id] for chunk_id in sorted(metadata)),
+            paths.chunks_blob, paths.chunks_offsets
+        )
+        write_topic_partitions(metadata.values(), paths.topics)
+        LexicalIndex.build(metadata[chunk_id] for chunk_id in sorted(metadata)).save(
+            paths.lexical, paths.lexical_postings, paths.lexical_lengths
+        )
+        write_index_meta(spec, paths.index_meta)
+        write_json_atomic(paths.manifest, manifest)
+
+        publish(version)
+        prune()
+        print(f"Published index version {version}")
+    else:
+        # Only file stats were refreshed
+        write_json_atomic(previous_paths.manifest, manifest)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Indexed {index.ntotal} chunks in {elapsed:.1f}s · "
+        f"{stats['files_changed']} files changed, {stats['files_deleted']} deleted · "
+        f"{stats['chunks_kept']} kept, {stats['chunks_from_cache']} from cache, "
+        f"{stats['chunks_embedded']} embedded, {len(stale_ids)} removed · "
+        f"peak RSS {peak_rss_mb():.0f} MB"
+    )
 
 
 if __name__ == "__main__":
-    import numpy as np
-    ingest()
+    parser = argparse.ArgumentParser(description="Build the GanitAI knowledge-base index")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--flush-size", type=int, default=FLUSH_SIZE)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and rebuild from scratch")
+    parser.add_argument("--index-type", choices=sorted(INDEX_TYPES), help="defaults to the previous build's type")
+    parser.add_argument("--nlist", type=int, help="IVF lists")
+    parser.add_argument("--pq-m", type=int, help="PQ sub-quantizers")
+    parser.add_argument("--hnsw-m", type=int, help="HNSW neighbours per node")
+    parser.add_argument("--nprobe", type=int, help="default IVF lists probed per query")
+    parser.add_argument("--ef-search", type=int, help="default HNSW search depth")
+    args = parser.parse_args()
+
+    params = {
+        key: value for key, value in
+        [("nlist", args.nlist), ("pq_m", args.pq_m), ("hnsw_m", args.hnsw_m)]
+        if value is not None
+    }
+    search = {
+        key: value for key, value in
+        [("nprobe", args.nprobe), ("ef_search", args.ef_search)]
+        if value is not None
+    }
+
+    ingest(
+        batch_size=args.batch_size,
+        flush_size=args.flush_size,
+        workers=args.workers,
+        full=args.full,
+        index_type=args.index_type,
+        params=params or None,
+        search=search or None
+    )
@@ -0,0 +1,230 @@
+import os
+import re
+import json
+import math
+from collections import Counter
+
+import numpy as np
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+SYMBOLS = {
+    "−": "-", "×": "*", "·": "*", "÷": "/", "√": " sqrt ", "π": " pi ",
+    "∫": " integral ", "∑": " sum ", "Σ": " sum ", "→": " ", "∞": " infinity ",
+    "∪": " union ", "∩": " intersection ", "≤": "<=", "≥": ">=", "±": " ",
+}
+SUPERSCRIPTS = str.maketrans("⁰¹²³⁴⁵⁶⁷⁸⁹⁻ⁿ", "0123456789-n")
+
+SYNONYMS = {
+    "determinant": "det",
+    "limit": "lim",
+    "limits": "lim",
+    "logarithm": "log",
+    "ln": "log",
+}
+
+STOPWORDS = {
+    "a", "an", "the", "of", "to", "and", "or", "is", "are", "be", "in", "on",
+    "for", "with", "by", "as", "at", "that", "this", "it", "its", "if", "then",
+    "what", "find", "given", "when", "from",
+}
+
+# Bases kept whole in powers: sin^2 x is "sin" squared, not "si" times n^2
+FUNCTION_BASES = {"sin", "cos", "tan", "sec", "csc", "cot", "log", "ln", "exp", "e", "pi"}
+# The only bases split into a coefficient and a variable: 2x^3, ax^2
+COEFFICIENT_BASE_RE = re.compile(r"(\d+|[a-z])([a-z])")
+
+TOKEN_RE = re.compile(r"""
+    p\(\s*[a-z]\s*\|\s*[a-z]\s*\)       # conditional probability P(A|B)
+  | p\(\s*[a-z]\s*\)                    # P(A)
+  | [a-z0-9]+\^(?:\(-?[a-z0-9]+\)|-?(?:\d+|[a-z]))   # powers: x^2, e^x, a^-1, ax^2
+  | \d+(?:\.\d+)?                       # numbers
+  | [a-z]+                              # words, function names, variables
+  | [/!]                                # division, factorial
+""", re.VERBOSE)
+
+
+def tokenize(text: str):
+    """
+    Math-aware tokenizer. Keeps symbolic structure such as `x^2`, `P(A|B)`
+    and `/` as tokens, and maps unicode math notation to ASCII first.
+    """
+    text = text.lower()
+    for symbol, replacement in SYMBOLS.items():
+        text = text.replace(symbol, replacement)
+    text = re.sub(r"[⁰¹²³⁴⁵⁶⁷⁸⁹⁻ⁿ]+", lambda m: "^" + m.group().translate(SUPERSCRIPTS), text)
+    text = re.sub(r"\s*\^\s*", "^", text)
+
+    tokens = []
+    for token in TOKEN_RE.findall(text):
+        if token.startswith("p("):
+            # Match the pattern, not the event names
+            tokens.append("p(|)" if "|" in token else "p()")
+        elif "^" in token:
+            base, power = token.split("^", 1)
+            power = "^" + power.strip("()")
+            match = COEFFICIENT_BASE_RE.fullmatch(base)
+            if match and base not in FUNCTION_BASES:
+                coefficient, base = match.groups()
+                if coefficient not in STOPWORDS:
+                    tokens.append(coefficient)
+            tokens.append(SYNONYMS.get(base, base) + power)
+            tokens.append(power)
+        elif token not in STOPWORDS:
+            tokens.append(SYNONYMS.get(token, token))
+
+    return tokens
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over chunk texts, keyed by chunk id. Postings are
+    int32 (doc id, tf) rows grouped by term, and `terms` maps each term to
+    its (start, count) span, so a saved index is memory-mapped instead of
+    parsed, and its pages are shared between worker processes.
+    """
+
+    def __init__(self, terms: dict, postings: np.ndarray, doc_lengths: np.ndarray, num_docs: int):
+        self.terms = terms
+        self.postings = postings
+        self.doc_lengths = doc_lengths  # indexed by chunk id; 0 where absent
+        self.num_docs = num_docs
+        self.avg_len = float(doc_lengths.sum()) / num_docs if num_docs else 0.0
+
+    @classmethod
+    def from_postings(cls, postings: dict, doc_lengths: dict):
+        """
+        Pack {term: [[doc_id, tf], ...]} and {doc_id: length} into arrays.
+        """
+        terms = {}
+        rows = []
+        for term, term_postings in postings.items():
+            terms[term] = (len(rows), len(term_postings))
+            rows.extend(term_postings)
+
+        lengths = np.zeros(max(doc_lengths, default=-1) + 1, dtype="int32")
+        for doc_id, length in doc_lengths.items():
+            lengths[doc_id] = length
+
+        return cls(terms, np.asarray(rows, dtype="int32").reshape(-1, 2), lengths, len(doc_lengths))
+
+    @classmethod
+    def build(cls, chunks):
+        postings = {}
+        doc_lengths = {}
+
+        for chunk in chunks:
+            terms = Counter(tokenize(chunk["text"]))
+            doc_lengths[chunk["id"]] = sum(terms.values())
+            for term, tf in terms.items():
+                postings.setdefault(term, []).append([chunk["id"], tf])
+
+        return cls.from_postings(postings, doc_lengths)
+
+    @classmethod
+    def load(cls, path: str, postings_path: str, lengths_path: str, mmap: bool = True):
+        with open(path, "r") as f:
+            saved = json.load(f)
+
+        def read(array_path):
+            if not os.path.getsize(array_path):
+                return np.zeros(0, dtype="int32")
+            if mmap:
+                return np.memmap(array_path, dtype="int32", mode="r")
+            return np.fromfile(array_path, dtype="int32")
+
+        return cls(
+            {term: tuple(span) for term, span in saved["terms"].items()},
+            read(postings_path).reshape(-1, 2),
+            read(lengths_path),
+            saved["num_docs"]
+        )
+
+    def save(self, path: str, postings_path: str, lengths_path: str):
+        np.ascontiguousarray(self.postings, dtype="int32").tofile(postings_path + ".tmp")
+        np.ascontiguousarray(self.doc_lengths, dtype="int32").tofile(lengths_path + ".tmp")
+        with open(path + ".tmp", "w") as f:
+            json.dump({"num_docs": self.num_docs, "terms": self.terms}, f)
+
+        os.replace(postings_path + ".tmp", postings_path)
+        os.replace(lengths_path + ".tmp", lengths_path)
+        os.replace(path + ".tmp", path)
+
+    def search(self, query: str, top_k: int, allowed_ids=None):
+        """
+        Returns [(chunk_id, score)] best first, optionally restricted
+        to `allowed_ids` (an array of chunk ids).
+        """
+        scores = np.zeros(len(self.doc_lengths), dtype="float64")
+        matched = False
+
+        for term in set(tokenize(query)):
+            span = self.terms.get(term)
+            if span is None:
+                continue
+            start, count = span
+            matched = True
+
+            rows = self.postings[start:start + count]
+            doc_ids = rows[:, 0]
+            tf = rows[:, 1].astype("float64")
+
+            idf = math.log(1 + (self.num_docs - count + 0.5) / (count + 0.5))
+            norm = K1 * (1 - B + B * self.doc_lengths[doc_ids] / self.avg_len)
+            # A term lists each document once, so the fancy-indexed add is safe
+            scores[doc_ids] += idf * tf * (K1 + 1) / (tf + norm)
+
+        if not matched:
+            return []
+
+        if allowed_ids is not None:
+            allowed = np.zeros(len(scores), dtype=bool)
+            allowed_ids = np.asarray(allowed_ids)
+            allowed[allowed_ids[allowed_ids < len(scores)]] = True
+            scores[~allowed] = 0.0
+
+        hits = np.flatnonzero(scores > 0)
+        best = hits[np.argsort(-scores[hits], kind="stable")[:top_k]]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in best]
+
+
+def reciprocal_rank_fusion(rankings, k: int = 60):
+    """
+    Fuse several best-first id lists into one, by summed 1 / (k + rank).
+    """
+    fused = Counter()
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            fused[doc_id] += 1.0 / (k + rank)
+    return [doc_id for doc_id, _ in fused.most_common()]
+
+
+# (text, tokens) that tokenize must keep producing; run this module to check
+TOKENIZE_EXAMPLES = [
+    ("sin^2 x", ["sin^2", "^2", "x"]),
+    ("log^2 x", ["log^2", "^2", "x"]),
+    ("ln^2 x", ["log^2", "^2", "x"]),
+    ("cos²x", ["cos^2", "^2", "x"]),
+    ("10^3", ["10^3", "^3"]),
+    ("2x^3", ["2", "x^3", "^3"]),
+    ("ax^2 + bx", ["x^2", "^2", "bx"]),
+    ("x² + y²", ["x^2", "^2", "y^2", "^2"]),
+    ("e^x", ["e^x", "^x"]),
+    ("e^(2x)", ["e^2x", "^2x"]),
+    ("a^-1", ["a^-1", "^-1"]),
+    ("P(A|B) / P(B)", ["p(|)", "/", "p()"]),
+    ("determinant of A", ["det"]),
+]
+
+
+if __name__ == "__main__":
+    failures = 0
+    for text, expected in TOKENIZE_EXAMPLES:
+        tokens = tokenize(text)
+        if tokens != expected:
+            failures += 1
+            print(f"{text!r}: expected {expected}, got {tokens}")
+    print(f"{len(TOKENIZE_EXAMPLES) - failures}/{len(TOKENIZE_EXAMPLES)} tokenize examples pass")
+    raise SystemExit(1 if failures else 0)
@@ -1,31 +1,301 @@
+import os
 import json
+import time
+import threading
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
-INDEX_PATH = "rag/faiss.index"
-META_PATH = "rag/metadata.json"
-MODEL_NAME = "all-MiniLM-L6-v2"
+from rag.chunk_store import ChunkStore, chunk_store_exists, read_topic_partitions
+from rag.index_factory import (
+    filtered_search_params, prepare_vectors, read_index_meta, set_search_params
+)
+from rag.lexical import LexicalIndex, reciprocal_rank_fusion
+from rag.versions import IndexPaths, current_paths
+from tools import embedder
+
+# Topic-agnostic chunks (e.g. solution templates) are searched with every topic
+SHARED_TOPICS = ("general",)
+MIN_TOPIC_HITS = 2
+
+# Hybrid retrieval: candidates taken from each leg before rank fusion, and
+# how far the k-th lexical score must lead the next one to skip dense search
+HYBRID_CANDIDATES = 20
+DECISIVE_RATIO = 2.0
+
+# How often a request may check whether a new index version was published
+RELOAD_CHECK_SECONDS = 2.0
+
+# Zero-copy mapping of flat codes; older faiss builds only have IO_FLAG_MMAP
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def read_index(path: str, mmap: bool = True):
+    if mmap:
+        try:
+            return faiss.read_index(path, MMAP_FLAGS)
+        except RuntimeError:
+            pass  # index type cannot be mapped
+    return faiss.read_index(path)
+
+
+class IndexSnapshot:
+    """
+    Everything loaded from one index version. Never mutated after
+    loading (apart from its filter cache), so a request can keep using
+    it while a newer snapshot is swapped in; it is freed, unmapping its
+    files, once the last request holding it finishes.
+    """
+
+    def __init__(
+        self,
+        paths: IndexPaths,
+        mmap: bool = True,
+        nprobe: int = None,
+        ef_search: int = None,
+        hybrid: bool = True
+    ):
+        self.root = paths.root
+        self.spec = read_index_meta(paths.index_meta)
+        self.index = read_index(paths.index, mmap)
+        set_search_params(self.index, self.spec, nprobe, ef_search)
+
+        if mmap and chunk_store_exists(paths.chunks_blob, paths.chunks_offsets):
+            self.chunks = ChunkStore(paths.chunks_blob, paths.chunks_offsets)
+        else:
+            with open(paths.metadata, "r") as f:
+                chunks = json.load(f)
+
+            # Index labels are chunk ids; older builds used list positions
+            self.chunks = {chunk.get("id", i): chunk for i, chunk in enumerate(chunks)}
+
+        self.lexical = (
+            LexicalIndex.load(paths.lexical, paths.lexical_postings, paths.lexical_lengths, mmap)
+            if hybrid and os.path.exists(paths.lexical) else None
+        )
+
+        self.topic_ids = read_topic_partitions(paths.topics)
+        self._topic_filters = {}
+
+    def topic_filter(self, topic: str):
+        """
+        Cached (search params, sorted id array) limiting a search to one topic's
+        chunks plus the shared ones. None when the topic has no partition.
+        """
+        if topic not in self._topic_filters:
+            topic_filter = None
+            if topic in self.topic_ids:
+                ids = np.concatenate(
+                    [self.topic_ids[topic]] +
+                    [self.topic_ids[t] for t in SHARED_TOPICS if t in self.topic_ids]
+                )
+                sel = faiss.IDSelectorBatch(ids)
+                params = filtered_search_params(self.index, self.spec, sel)
+                params._sel = sel  # the params hold a raw pointer to the selector
+                topic_filter = (params, ids)
+            self._topic_filters[topic] = topic_filter
+
+        return self._topic_filters[topic]
+
+    def dense_ids(self, query_emb, k: int, params=None):
+        _, indices = self.index.search(query_emb, k, params=params)
+        return [int(idx) for idx in indices[0] if idx >= 0]
 
 
 class Retriever:
-    def __init__(self, top_k: int = 4):
+    def __init__(
+        self,
+        top_k: int = 4,
+        mmap: bool = True,
+        nprobe: int = None,
+        ef_search: int = None,
+        min_topic_hits: int = MIN_TOPIC_HITS,
+        hybrid: bool = True,
+        auto_reload: bool = True
+    ):
+        """
+        With `mmap`, the index and the packed chunk store are mapped
+        rather than loaded, so startup cost does not grow with the corpus
+        and worker processes share pages. Falls back to metadata.json for
+        builds that predate the chunk store.
+
+        `nprobe` (IVF) and `ef_search` (HNSW) override the search
+        parameters recorded at ingest time. A topic search that returns
+        fewer than `min_topic_hits` chunks falls back to the whole index.
+        With `hybrid`, BM25 over math tokens runs alongside the dense
+        search when a lexical index was built.
+
+        With `auto_reload`, a newly published index version is loaded in
+        a background thread and swapped in between requests.
+        """
         self.top_k = top_k
-        self.model = SentenceTransformer(MODEL_NAME)
-        self.index = faiss.read_index(INDEX_PATH)
+        self.min_topic_hits = min_topic_hits
+        self.auto_reload = auto_reload
+        self._load_options = {
+            "mmap": mmap,
+            "nprobe": nprobe,
+            "ef_search": ef_search,
+            "hybrid": hybrid
+        }
+
+        self._snapshot = IndexSnapshot(current_paths(), **self._load_options)
+        self._reload_lock = threading.Lock()
+        self._reloading = False
+        self._last_check = time.monotonic()
+
+    @property
+    def version(self) -> str:
+        return self._snapshot.root
+
+    def reload(self) -> bool:
+        """
+        Load the published version if it differs from the one in use and
+        swap it in. Returns True when a swap happened.
+        """
+        paths = current_paths()
+        if paths.root == self._snapshot.root:
+            return False
+
+        snapshot = IndexSnapshot(paths, **self._load_options)
+        # A single reference assignment: requests already running keep
+        # the snapshot they started with
+        self._snapshot = snapshot
+        return True
+
+    def _background_reload(self):
+        try:
+            self.reload()
+        except Exception as e:
+            print(f"Index reload failed, keeping {self._snapshot.root}: {e}")
+        finally:
+            self._reloading = False
 
-        with open(META_PATH, "r") as f:
-            self.metadata = json.load(f)
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if not self.auto_reload or now - self._last_check < RELOAD_CHECK_SECONDS:
+            return
+        self._last_check = now
 
-    def retrieve(self, query: str):
-        query_emb = self.model.encode(query)
-        query_emb = np.array([query_emb]).astype("float32")
+        if current_paths().root == self._snapshot.root:
+            return
 
-        distances, indices = self.index.search(query_emb, self.top_k)
+        with self._reload_lock:
+            if self._reloading:
+                return
+            self._reloading = True
+
+        threading.Thread(target=self._background_reload, daemon=True).start()
+
+    def _is_decisive(self, hits) -> bool:
+        """
+        The lexical leg settles the query when it found at least top_k
+        chunks and the k-th clearly outscores everything after it.
+        """
+        if len(hits) < self.top_k:
+            return False
+        next_score = hits[self.top_k][1] if len(hits) > self.top_k else 0.0
+        return hits[self.top_k - 1][1] >= DECISIVE_RATIO * next_score
+
+    def _ranked_ids(self, snapshot: IndexSnapshot, query: str, query_emb, topic_filter=None):
+        """
+        `query_emb` is a callable so the query is only embedded when the
+        dense leg actually runs.
+        """
+        params, allowed_ids = topic_filter or (None, None)
+
+        hits = []
+        if snapshot.lexical is not None:
+            hits = snapshot.lexical.search(query, max(HYBRID_CANDIDATES, self.top_k + 1), allowed_ids)
+            if self._is_decisive(hits):
+                return [doc_id for doc_id, _ in hits[:self.top_k]]
+
+        if not hits:
+            return snapshot.dense_ids(query_emb(), self.top_k, params)
+
+        dense = snapshot.dense_ids(query_emb(), max(HYBRID_CANDIDATES, self.top_k), params)
+        fused = reciprocal_rank_fusion([[doc_id for doc_id, _ in hits], dense])
+        return fused[:self.top_k]
+
+    def retrieve(self, query: str, query_emb=None, topic: str = None):
+        """
+        With a known `topic` (from the parser), only that topic's partition
+        is searched; `None` or "unknown" searches everything.
+        """
+        self._maybe_reload()
+        snapshot = self._snapshot
+
+        prepared = []
+
+        def prepared_query():
+            if not prepared:
+                emb = query_emb if query_emb is not None else embedder.encode(query)
+                prepared.append(prepare_vectors(emb, snapshot.spec))
+            return prepared[0]
+
+        topic_filter = snapshot.topic_filter(topic) if topic and topic != "unknown" else None
+
+        ids = []
+        if topic_filter is not None:
+            ids = self._ranked_ids(snapshot, query, prepared_query, topic_filter)
+        if topic_filter is None or len(ids) < self.min_topic_hits:
+            ids = self._ranked_ids(snapshot, query, prepared_query)
 
         results = []
-        for idx in indices[0]:
-            if idx < len(self.metadata):
-                results.append(self.metadata[idx])
+        for idx in ids:
+            chunk = snapshot.chunks.get(idx)
+            if chunk is not None:
+                results.append(chunk)
 
         return results
+
+    def retrieve_batch(self, queries, top_k: int = None, batch_size: int = 64):
+        """
+        Dense retrieval for many queries at once: one batched forward pass
+        and one batched FAISS search. Returns one list per query of chunk
+        dicts extended with the raw FAISS "distance" and a higher-is-better
+        "score" (the inner product, or the negated L2 distance).
+        """
+        self._maybe_reload()
+        snapshot = self._snapshot
+
+        top_k = top_k or self.top_k
+        if not queries:
+            return []
+
+        query_embs = prepare_vectors(embedder.encode_batch(list(queries), batch_size=batch_size), snapshot.spec)
+        distances, indices = snapshot.index.search(query_embs, top_k)
+
+        sign = 1.0 if snapshot.spec["metric"] == "ip" else -1.0
+
+        batch_results = []
+        for row_distances, row_indices in zip(distances, indices):
+            results = []
+            for distance, idx in zip(row_distances, row_indices):
+                chunk = snapshot.chunks.get(int(idx)) if idx >= 0 else None
+                if chunk is not None:
+                    results.append({
+                        **chunk,
+                        "distance": float(distance),
+                        "score": sign * float(distance)
+                    })
+            batch_results.append(results)
+
+        return batch_results
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Batch retrieval over the knowledge base")
+    parser.add_argument("queries", help="file with one query per line ('-' for stdin)")
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    source = sys.stdin if args.queries == "-" else open(args.queries, "r")
+    with source:
+        queries = [line.strip() for line in source if line.strip()]
+
+    retriever = Retriever(top_k=args.top_k, auto_reload=False)
+    for query, results in zip(queries, retriever.retrieve_batch(queries, batch_size=args.batch_size)):
+        print(json.dumps({"query": query, "results": results}))
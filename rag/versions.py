@@ -0,0 +1,86 @@
+import os
+import shutil
+from datetime import datetime
+
+INDEX_ROOT = "rag/index"
+CURRENT_PATH = os.path.join(INDEX_ROOT, "CURRENT")
+
+# Builds made before versioning wrote straight into rag/
+LEGACY_DIR = "rag"
+
+KEEP_VERSIONS = 3
+
+
+class IndexPaths:
+    """
+    File layout of one index build directory.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.index = os.path.join(root, "faiss.index")
+        self.metadata = os.path.join(root, "metadata.json")
+        self.manifest = os.path.join(root, "manifest.json")
+        self.index_meta = os.path.join(root, "index_meta.json")
+        self.chunks_blob = os.path.join(root, "chunks.bin")
+        self.chunks_offsets = os.path.join(root, "chunks.offsets")
+        self.topics = os.path.join(root, "topics.npz")
+        self.lexical = os.path.join(root, "lexical.json")
+        self.lexical_postings = os.path.join(root, "lexical.postings")
+        self.lexical_lengths = os.path.join(root, "lexical.lengths")
+
+
+def current_version():
+    """
+    Name of the published version, or None before the first versioned build.
+    """
+    try:
+        with open(CURRENT_PATH, "r") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def current_paths() -> IndexPaths:
+    version = current_version()
+    return IndexPaths(os.path.join(INDEX_ROOT, version) if version else LEGACY_DIR)
+
+
+def new_version():
+    """
+    Create an empty, not yet published, version directory.
+    """
+    version = "v" + datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    root = os.path.join(INDEX_ROOT, version)
+    os.makedirs(root)
+    return version, IndexPaths(root)
+
+
+def publish(version: str):
+    """
+    Atomically point CURRENT at `version`. Readers see either the old or
+    the new name, never a partial write.
+    """
+    tmp_path = CURRENT_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, CURRENT_PATH)
+
+
+def prune(keep: int = KEEP_VERSIONS):
+    """
+    Delete all but the newest `keep` versions, never the current one.
+    Processes still holding a pruned version keep working: open and
+    memory-mapped files stay valid until they are closed.
+    """
+    current = current_version()
+    versions = sorted(
+        name for name in os.listdir(INDEX_ROOT)
+        if name.startswith("v") and os.path.isdir(os.path.join(INDEX_ROOT, name))
+    )
+
+    for name in versions[:-keep] if keep else versions:
+        if name != current:
+            shutil.rmtree(os.path.join(INDEX_ROOT, name), ignore_errors=True)
@@ -1,31 +1,198 @@
-from faster_whisper import WhisperModel
+import io
+import os
+import time
+import difflib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Load once (important for performance)
-MODEL = WhisperModel(
-    "base",
-    device="cpu",
-    compute_type="int8"
+import numpy as np
+
+from tools import model_registry
+from tools.media_cache import MediaCache, content_key
+
+
+# Cascade tiers, cheapest first. A tier's transcript is kept when its
+# mean word probability reaches CONFIDENCE_THRESHOLD and no math keyword
+# looks mangled; otherwise the next tier re-decodes the same audio.
+TIERS = (
+    {"name": "tiny-greedy", "model": "tiny", "beam_size": 1},
+    {"name": "base-beam5", "model": "base", "beam_size": 5},
+    {"name": "small-beam5", "model": "small", "beam_size": 5},
 )
 
+MATH_KEYWORDS = {
+    "integral", "integrate", "derivative", "differentiate", "limit", "matrix",
+    "determinant", "eigenvalue", "vector", "probability", "equation", "polynomial",
+    "quadratic", "logarithm", "sine", "cosine", "tangent", "squared", "cubed",
+    "root", "square", "factorial", "fraction", "infinity", "solve", "evaluate",
+    "plus", "minus", "times", "divided", "power", "exponent", "theta", "alpha",
+}
+MANGLED_SIMILARITY = 0.8
+
+# Real words near a keyword that must never count as mangled ("since" is
+# close to "sine", "coin" to "cosine"), shipped with the code so every
+# host flags the same words; keyword inflections are added to it
+VOCABULARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "asr_vocabulary.txt")
+_KNOWN_WORDS = None
+
+
+def _whisper_loader(size: str):
+    def load():
+        from faster_whisper import WhisperModel
+        return WhisperModel(
+            size,
+            device="cpu",
+            compute_type="int8"
+        )
+    return load
+
+
+# Each tier's model is loaded once, on first use (or by a warm-up thread)
+for _size in sorted({tier["model"] for tier in TIERS}):
+    model_registry.register(f"whisper_{_size}", _whisper_loader(_size))
+
+# Warm up only the first tier; larger models load if a clip escalates
+MODEL_NAMES = (f"whisper_{TIERS[0]['model']}",)
+
 CONFIDENCE_THRESHOLD = 0.75
+SAMPLING_RATE = 16000  # what Whisper expects
+
+# Cached results are only valid for this model and decoding configuration
+ASR_CONFIG = {
+    "tiers": TIERS,
+    "compute_type": "int8",
+    "language": "en",
+    "confidence_threshold": CONFIDENCE_THRESHOLD,
+    "mangled_similarity": MANGLED_SIMILARITY,
+}
+CACHE = MediaCache("asr", ASR_CONFIG)
+
+
+def media_bytes(audio) -> bytes:
+    """
+    Raw bytes identifying a recording given as a path, encoded bytes or
+    a decoded float32 array.
+    """
+    if isinstance(audio, np.ndarray):
+        return np.ascontiguousarray(audio, dtype=np.float32).tobytes()
+    if isinstance(audio, (bytes, bytearray, memoryview)):
+        return bytes(audio)
+    with open(audio, "rb") as f:
+        return f.read()
+
 
+def decode_audio(audio) -> np.ndarray:
+    """
+    Mono float32 samples at SAMPLING_RATE from a path, encoded bytes
+    (WAV, MP3, ...) or an array that is already decoded.
+    """
+    if isinstance(audio, np.ndarray):
+        return np.ascontiguousarray(audio, dtype=np.float32)
+
+    from faster_whisper import decode_audio as ffmpeg_decode
+
+    source = io.BytesIO(bytes(audio)) if isinstance(audio, (bytes, bytearray, memoryview)) else audio
+    return ffmpeg_decode(source, sampling_rate=SAMPLING_RATE)
 
-def transcribe_audio(audio_path: str) -> dict:
+
+def transcribe_audio(audio) -> dict:
     """
     Transcribes audio and highlights low-confidence words.
     Returns raw text, highlighted HTML, and average confidence.
+    Accepts a path, encoded bytes or 16 kHz mono float32 samples;
+    results are cached by content hash of the recording.
     """
+    data = media_bytes(audio)
+    return CACHE.get_or_compute(data, lambda: _transcribe(audio if isinstance(audio, np.ndarray) else data))
 
-    segments, info = MODEL.transcribe(
-        audio_path,
-        beam_size=5,
-        language="en",
-        word_timestamps=True
-    )
 
-    full_text = []
-    highlighted = []
-    confidences = []
+def _transcribe(audio) -> dict:
+    words, attempts = decode_cascade(decode_audio(audio))
+    return {**build_result(words), "asr_tier": attempts[-1]["tier"], "asr_attempts": attempts}
+
+
+def _inflections(stem: str):
+    forms = {stem}
+    for suffix in ("s", "es", "d", "ed", "ing", "ion", "ions", "al", "ial", "ly", "ally"):
+        forms.add(stem + suffix)
+        if stem.endswith("e"):
+            forms.add(stem[:-1] + suffix)
+    if stem.endswith("y"):
+        forms.update({stem[:-1] + "ies", stem[:-1] + "ied"})
+    return forms
+
+
+def known_words() -> set:
+    """
+    Words never counted as mangled, read on first use.
+    """
+    global _KNOWN_WORDS
+    if _KNOWN_WORDS is None:
+        known = set()
+        for keyword in MATH_KEYWORDS:
+            known |= _inflections(keyword)
+        with open(VOCABULARY_PATH, "r") as f:
+            known.update(line.strip() for line in f if line.strip() and not line.startswith("#"))
+        _KNOWN_WORDS = known
+    return _KNOWN_WORDS
+
+
+def mangled_keywords(words):
+    """
+    Words that nearly spell a math keyword without being a real word
+    ("integrel", "derivitive"): a sign the model misheard the question.
+    """
+    known = known_words()
+    mangled = []
+    for word in words:
+        token = "".join(ch for ch in word["word"].lower() if ch.isalpha())
+        if len(token) < 4 or token in known:
+            continue
+        if difflib.get_close_matches(token, MATH_KEYWORDS, n=1, cutoff=MANGLED_SIMILARITY):
+            mangled.append(word["word"])
+    return mangled
+
+
+def decode_cascade(samples: np.ndarray, offset: float = 0.0, initial_prompt: str = None):
+    """
+    Decode `samples` with the cheapest tier that is confident enough.
+    Returns (words, attempts); each attempt records the tier, its mean
+    word probability and any mangled keywords, the last one being used.
+    """
+    attempts = []
+
+    for tier in TIERS:
+        t0 = time.perf_counter()
+        segments, _ = model_registry.get(f"whisper_{tier['model']}").transcribe(
+            samples,
+            beam_size=tier["beam_size"],
+            language="en",
+            word_timestamps=True,
+            initial_prompt=initial_prompt
+        )
+        words = collect_words(segments, offset=offset)
+
+        confidence = build_result(words)["confidence"]
+        mangled = mangled_keywords(words)
+        attempts.append({
+            "tier": tier["name"],
+            "confidence": confidence,
+            "mangled": mangled,
+            "seconds": round(time.perf_counter() - t0, 3)
+        })
+
+        # No words means no speech: a larger model will not find any either
+        if not words or (confidence >= CONFIDENCE_THRESHOLD and not mangled):
+            break
+
+    return words, attempts
+
+
+def collect_words(segments, offset: float = 0.0):
+    """
+    [{"word", "probability", "start", "end"}] from Whisper segments, with
+    times shifted by `offset` seconds.
+    """
+    words = []
 
     for segment in segments:
         if not segment.words:
@@ -36,17 +203,34 @@ def transcribe_audio(audio_path: str) -> dict:
             if not word_text:
                 continue
 
-            prob = word.probability if word.probability is not None else 0.5
-            confidences.append(prob)
+            words.append({
+                "word": word_text,
+                "probability": word.probability if word.probability is not None else 0.5,
+                "start": round(word.start + offset, 2),
+                "end": round(word.end + offset, 2)
+            })
 
-            if prob < CONFIDENCE_THRESHOLD:
-                highlighted.append(
-                    f"<span style='background-color:#FFF3A3'>{word_text}</span>"
-                )
-            else:
-                highlighted.append(word_text)
+    return words
+
+
+def build_result(words) -> dict:
+    full_text = []
+    highlighted = []
+    confidences = []
+
+    for word in words:
+        word_text = word["word"]
+        prob = word["probability"]
+        confidences.append(prob)
+
+        if prob < CONFIDENCE_THRESHOLD:
+            highlighted.append(
+                f"<span style='background-color:#FFF3A3'>{word_text}</span>"
+            )
+        else:
+            highlighted.append(word_text)
 
-            full_text.append(word_text)
+        full_text.append(word_text)
 
     avg_confidence = (
         sum(confidences) / len(confidences)
@@ -58,3 +242,280 @@ def transcribe_audio(audio_path: str) -> dict:
         "highlighted_html": " ".join(highlighted),
         "confidence": round(avg_confidence, 3)
     }
+
+
+# ---------------------------------------------------------
+# Bulk: batched inference over the VAD segments of many recordings
+# ---------------------------------------------------------
+BATCH_SIZE = 16
+BATCH_WORKERS = 2  # recordings decoded and transcribed at once
+
+# Files the CLI picks up from a directory
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".flac", ".ogg", ".opus", ".webm", ".aac")
+
+
+def _load_batched(cpu_threads: int, workers: int):
+    from faster_whisper import BatchedInferencePipeline, WhisperModel
+
+    model = WhisperModel(
+        "base",
+        device="cpu",
+        compute_type="int8",
+        cpu_threads=cpu_threads,
+        num_workers=workers
+    )
+    return BatchedInferencePipeline(model=model)
+
+
+def transcribe_batch(
+    sources,
+    batch_size: int = BATCH_SIZE,
+    cpu_threads: int = 0,
+    workers: int = BATCH_WORKERS,
+    stats: dict = None
+):
+    """
+    Transcribe many recordings (paths, encoded bytes or samples) with
+    faster-whisper's BatchedInferencePipeline: each recording is split on
+    VAD segments that are decoded `batch_size` at a time, with `workers`
+    recordings in flight. `cpu_threads=0` lets CTranslate2 choose.
+
+    Yields (index, result) as recordings finish, result being
+    transcribe_audio's dict plus `audio_seconds`. A recording that fails
+    (unreadable, not audio) gets an empty result with an `error` instead
+    of ending the batch. If given, `stats` is filled with file and failure
+    counts, audio seconds, wall seconds and audio_sec_per_wall_sec.
+    """
+    name = f"whisper_batched_{cpu_threads}_{workers}"
+    model_registry.register(name, lambda: _load_batched(cpu_threads, workers))
+    pipeline = model_registry.get(name)
+
+    def transcribe_one(source):
+        samples = decode_audio(source)
+        segments, info = pipeline.transcribe(
+            samples,
+            batch_size=batch_size,
+            beam_size=5,
+            language="en",
+            word_timestamps=True
+        )
+        result = build_result(collect_words(segments))
+        result["audio_seconds"] = round(len(samples) / SAMPLING_RATE, 2)
+        return result
+
+    t0 = time.perf_counter()
+    audio_seconds = 0.0
+    failed = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(transcribe_one, source): i for i, source in enumerate(sources)}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                result = {**build_result([]), "audio_seconds": 0.0, "error": repr(e)}
+            audio_seconds += result["audio_seconds"]
+            yield futures[future], result
+
+    if stats is not None:
+        wall = time.perf_counter() - t0
+        stats.update({
+            "files": len(futures),
+            "failed": failed,
+            "audio_seconds": round(audio_seconds, 2),
+            "wall_seconds": round(wall, 2),
+            "audio_sec_per_wall_sec": round(audio_seconds / wall, 2) if wall else 0.0
+        })
+
+
+# ---------------------------------------------------------
+# Streaming: VAD-segmented, transcribed as speech segments close
+# ---------------------------------------------------------
+# A segment is complete once this much silence follows it
+VAD_MIN_SILENCE_MS = 500
+STREAM_CHUNK_SECONDS = 0.5
+# Audio before the new chunk that live VAD looks at again, so speech
+# cut at a chunk boundary is still detected as one span
+VAD_OVERLAP_MS = 1000
+
+TIERS_BY_NAME = {tier["name"]: i for i, tier in enumerate(TIERS)}
+
+STREAM_CACHE = MediaCache("asr_stream", {**ASR_CONFIG, "vad_min_silence_ms": VAD_MIN_SILENCE_MS})
+
+
+def iter_chunks(samples: np.ndarray, seconds: float = STREAM_CHUNK_SECONDS):
+    step = int(seconds * SAMPLING_RATE)
+    for start in range(0, len(samples), step):
+        yield samples[start:start + step]
+
+
+def _vad_options():
+    from faster_whisper.vad import VadOptions
+
+    return VadOptions(min_silence_duration_ms=VAD_MIN_SILENCE_MS)
+
+
+def clip_segments(samples: np.ndarray):
+    """
+    (speech samples, offset seconds) of a complete recording, from one
+    voice activity detection pass over the whole clip.
+    """
+    from faster_whisper.vad import get_speech_timestamps
+
+    for span in get_speech_timestamps(samples, _vad_options()):
+        yield samples[span["start"]:span["end"]], span["start"] / SAMPLING_RATE
+
+
+def stream_segments(chunks):
+    """
+    (speech samples, offset seconds) of 16 kHz float32 audio arriving as
+    `chunks`, each yielded as soon as enough silence follows it. Voice
+    activity detection only runs over the new chunk and VAD_OVERLAP_MS
+    before it, so the cost per chunk does not grow with the recording.
+    """
+    from faster_whisper.vad import get_speech_timestamps
+
+    vad_options = _vad_options()
+    silence = VAD_MIN_SILENCE_MS * SAMPLING_RATE // 1000
+    overlap = VAD_OVERLAP_MS * SAMPLING_RATE // 1000
+
+    buffer = np.zeros(0, dtype=np.float32)  # audio not yet yielded
+    consumed = 0                             # samples before `buffer`
+    spans = []                               # [start, end] in `buffer`
+
+    def detect(window_start):
+        for span in get_speech_timestamps(buffer[window_start:], vad_options):
+            start, end = span["start"] + window_start, span["end"] + window_start
+            if spans and start - spans[-1][1] < silence:
+                spans[-1][1] = max(spans[-1][1], end)  # the same speech, continued
+            else:
+                spans.append([start, end])
+
+    for chunk in chunks:
+        window_start = max(0, len(buffer) - overlap)
+        buffer = np.concatenate([buffer, np.asarray(chunk, dtype=np.float32)])
+        detect(window_start)
+
+        if not spans:
+            # Only silence so far: drop all but a short lead-in
+            if len(buffer) > silence:
+                consumed += len(buffer) - silence
+                buffer = buffer[-silence:]
+            continue
+
+        closed = [span for span in spans if len(buffer) - span[1] >= silence]
+        if not closed:
+            continue
+
+        start, end = closed[0][0], closed[-1][1]
+        yield buffer[start:end], (consumed + start) / SAMPLING_RATE
+
+        buffer = buffer[end:]
+        consumed += end
+        spans = [[s - end, e - end] for s, e in spans[len(closed):]]
+
+    if spans:
+        yield buffer[spans[0][0]:spans[-1][1]], (consumed + spans[0][0]) / SAMPLING_RATE
+
+
+def transcribe_segments(segments):
+    """
+    Transcribe speech segments ((samples, offset seconds), as produced by
+    clip_segments or stream_segments) one at a time. Yields the transcript
+    so far after every segment, as transcribe_audio's dict plus per-word
+    `words` and `final`; the last update has final=True.
+    """
+    words = []
+    attempts = []
+
+    def update(final):
+        # The largest tier any segment needed
+        tiers = [TIERS_BY_NAME[segment[-1]["tier"]] for segment in attempts]
+        return {
+            **build_result(words),
+            "words": list(words),
+            "asr_tier": TIERS[max(tiers)]["name"] if tiers else None,
+            "asr_attempts": list(attempts),
+            "final": final
+        }
+
+    for samples, offset in segments:
+        segment_words, segment_attempts = decode_cascade(
+            samples,
+            offset=offset,
+            # Earlier words keep the decoder in context across segments
+            initial_prompt=" ".join(w["word"] for w in words[-50:]) or None
+        )
+        words.extend(segment_words)
+        attempts.append(segment_attempts)
+        yield update(final=False)
+
+    yield update(final=True)
+
+
+def transcribe_stream(chunks):
+    """
+    transcribe_segments over live audio arriving as `chunks`.
+    """
+    return transcribe_segments(stream_segments(chunks))
+
+
+def stream_audio(audio):
+    """
+    transcribe_segments over a whole recording (path, bytes or samples),
+    caching the final transcript by content hash like transcribe_audio.
+
+    The recording is already complete (st.audio_input hands over the clip
+    when recording stops), so there is nothing to gain from replaying it
+    in chunks: VAD runs once, and the win over transcribe_audio is that
+    each speech segment is shown as soon as it is decoded.
+    """
+    data = media_bytes(audio)
+    key = content_key(data, STREAM_CACHE.config)
+
+    cached = STREAM_CACHE.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    samples = decode_audio(audio if isinstance(audio, np.ndarray) else data)
+    for update in transcribe_segments(clip_segments(samples)):
+        if update["final"]:
+            STREAM_CACHE.put(key, update)
+        yield update
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Batch-transcribe recorded questions")
+    parser.add_argument("inputs", nargs="+", help="audio files or directories of them")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--cpu-threads", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.inputs:
+        if os.path.isdir(path):
+            paths.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(AUDIO_EXTENSIONS)
+            ))
+        else:
+            paths.append(path)
+
+    run_stats = {}
+    for index, result in transcribe_batch(
+        paths, args.batch_size, args.cpu_threads, args.workers, stats=run_stats
+    ):
+        print(json.dumps({"path": paths[index], **result}), flush=True)
+
+    print(
+        f"{run_stats['files']} files ({run_stats['failed']} failed) · {run_stats['audio_seconds']}s audio in "
+        f"{run_stats['wall_seconds']}s · {run_stats['audio_sec_per_wall_sec']} audio-sec/wall-sec",
+        file=sys.stderr
+    )
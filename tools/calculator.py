@@ -1,9 +1,235 @@
-def safe_calculate(expression: str):
+import ast
+import time
+import operator
+import threading
+from collections import OrderedDict
+from fractions import Fraction
+
+ALLOWED_CHARS = "0123456789+-*/(). "
+
+# Cost limits: anything beyond them raises LimitExceeded instead of
+# pinning a core (e.g. 9**9**9**9)
+MAX_LENGTH = 512          # characters in the expression
+MAX_DEPTH = 64            # nested parentheses, or chained unary signs
+MAX_EXPONENT = 10_000     # |exponent| of an exact power
+MAX_BITS = 4096           # bit length of any exact intermediate value
+TIME_LIMIT = 0.05         # seconds per evaluation
+
+CACHE_SIZE = 1024         # compiled expressions kept
+
+_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+BINARY_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Pow: operator.pow,
+}
+UNARY_OPS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+
+class LimitExceeded(ValueError):
+    pass
+
+
+def _bits(value) -> int:
+    if isinstance(value, int):
+        return value.bit_length()
+    if isinstance(value, Fraction):
+        return max(value.numerator.bit_length(), value.denominator.bit_length())
+    return 0  # floats are bounded by construction
+
+
+def _check_power(base, exponent):
     """
-    Safely evaluate basic mathematical expressions.
+    Refuse exact powers whose result would exceed MAX_BITS, before
+    computing them.
+    """
+    if isinstance(exponent, float) or isinstance(base, float):
+        return  # float arithmetic: at worst OverflowError, never slow
+    if isinstance(exponent, Fraction) and exponent.denominator != 1:
+        return  # irrational result, computed as a float
+
+    if base in (0, 1, -1):
+        return  # any exponent is free
+    exponent = int(exponent)
+    if abs(exponent) > MAX_EXPONENT:
+        raise LimitExceeded(f"Exponent {exponent} exceeds {MAX_EXPONENT}")
+    # A lower bound on the result's size (|base| >= 2 ** (bits - 1)),
+    # so no power that fits is refused
+    if (_bits(base) - 1) * abs(exponent) + 1 > MAX_BITS:
+        raise LimitExceeded(f"Result of power would exceed {MAX_BITS} bits")
+
+
+def _exact_pow(base, exponent):
+    # int ** negative int is a float; keep it rational, like 2.0 ** -2
+    if isinstance(base, int) and isinstance(exponent, (int, Fraction)) and exponent < 0:
+        base = Fraction(base)
+    return base ** exponent
+
+
+def normalize_expression(expression: str) -> str:
+    return "".join(expression.split())
+
+
+def _paren_depth(expression: str) -> int:
+    depth = deepest = 0
+    for c in expression:
+        if c == "(":
+            depth += 1
+            deepest = max(deepest, depth)
+        elif c == ")":
+            depth -= 1
+    return deepest
+
+
+def _compile_node(node, exact: bool, unary_depth: int = 0):
+    """
+    Turn an AST node into a closure `f(deadline) -> value`, rejecting
+    anything but numeric literals and arithmetic operators.
     """
-    allowed_chars = "0123456789+-*/(). "
-    if not all(c in allowed_chars for c in expression):
+    if unary_depth > MAX_DEPTH:
+        raise LimitExceeded(f"More than {MAX_DEPTH} chained unary operators")
+
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        value = node.value
+        if exact and isinstance(value, float):
+            value = Fraction(str(value))  # 0.1 means 1/10, not its binary approximation
+        if _bits(value) > MAX_BITS:
+            raise LimitExceeded(f"Literal exceeds {MAX_BITS} bits")
+        return lambda deadline: value
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPS:
+        op = UNARY_OPS[type(node.op)]
+        operand = _compile_node(node.operand, exact, unary_depth + 1)
+        return lambda deadline: op(operand(deadline))
+
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPS:
+        op_type = type(node.op)
+        op = BINARY_OPS[op_type]
+        if exact and op_type is ast.Div:
+            op = lambda a, b: Fraction(a) / Fraction(b)
+        elif exact and op_type is ast.Pow:
+            op = _exact_pow
+        left = _compile_node(node.left, exact)
+        right = _compile_node(node.right, exact)
+
+        def evaluate(deadline):
+            a = left(deadline)
+            b = right(deadline)
+            if time.perf_counter() > deadline:
+                raise LimitExceeded(f"Evaluation exceeded {TIME_LIMIT}s")
+            if op_type is ast.Pow:
+                _check_power(a, b)
+            try:
+                result = op(a, b)
+            except OverflowError:
+                raise LimitExceeded("Result is too large for a float")
+            if _bits(result) > MAX_BITS:
+                raise LimitExceeded(f"Intermediate value exceeds {MAX_BITS} bits")
+            return result
+
+        return evaluate
+
+    raise ValueError(f"Unsupported syntax: {type(node).__name__}")
+
+
+def compile_expression(expression: str, exact: bool = False):
+    """
+    Compiled evaluator for `expression`, cached by its whitespace-free
+    form so repeated evaluations skip parsing and validation.
+    """
+    key = (normalize_expression(expression), exact)
+
+    with _CACHE_LOCK:
+        if key in _CACHE:
+            _CACHE.move_to_end(key)
+            return _CACHE[key]
+
+    if not all(c in ALLOWED_CHARS for c in expression):
         raise ValueError("Unsafe expression")
+    if len(key[0]) > MAX_LENGTH:
+        raise LimitExceeded(f"Expression longer than {MAX_LENGTH} characters")
+    # Checked on the text: a flat sum is a deep tree, but not a deep expression
+    if _paren_depth(key[0]) > MAX_DEPTH:
+        raise LimitExceeded(f"Parentheses nested deeper than {MAX_DEPTH}")
+
+    try:
+        tree = ast.parse(key[0], mode="eval")
+    except (SyntaxError, RecursionError) as e:
+        raise ValueError(f"Invalid expression: {e}")
+    compiled = _compile_node(tree.body, exact)
+
+    with _CACHE_LOCK:
+        _CACHE[key] = compiled
+        while len(_CACHE) > CACHE_SIZE:
+            _CACHE.popitem(last=False)
+
+    return compiled
+
+
+def safe_calculate(expression: str, exact: bool = False):
+    """
+    Safely evaluate basic mathematical expressions.
+    With `exact`, decimals and division are rational (Fraction) instead
+    of floating point. Raises LimitExceeded (a ValueError) when the
+    expression is too large, too deep or too slow to evaluate.
+    """
+    result = compile_expression(expression, exact)(time.perf_counter() + TIME_LIMIT)
+
+    if isinstance(result, Fraction) and result.denominator == 1:
+        return result.numerator
+    return result
+
+
+def clear_cache():
+    with _CACHE_LOCK:
+        _CACHE.clear()
+
+
+def benchmark(expressions=None, repeat: int = 2000):
+    """
+    Per-call latency of eval() against the compiled evaluator, cold
+    (parsed every time) and warm (served from the expression cache).
+    """
+    import timeit
+
+    expressions = expressions or [
+        "1 + 1",
+        "(3 + 4) * 5 - 6 / 2",
+        "((1.5 + 2.25) * (7 - 3)) / (2 ** 3)",
+        "2 ** 64 // 3 + (10 - 4) * (8 / 5)",
+    ]
+
+    def cold(expr):
+        clear_cache()
+        return safe_calculate(expr)
+
+    print(f"{'expression':<40}{'eval us':>10}{'cold us':>10}{'warm us':>10}")
+    for expr in expressions:
+        assert safe_calculate(expr) == eval(expr)
+        timings = [
+            timeit.timeit(lambda: eval(expr), number=repeat),
+            timeit.timeit(lambda: cold(expr), number=repeat),
+            timeit.timeit(lambda: safe_calculate(expr), number=repeat),
+        ]
+        print(f"{expr:<40}" + "".join(f"{t / repeat * 1e6:>10.2f}" for t in timings))
+
+    for expr in ("9**9**9**9", "(" * 100 + "1" + ")" * 100, "2**4096 * 2**4096"):
+        t0 = time.perf_counter()
+        try:
+            safe_calculate(expr)
+            outcome = "evaluated"
+        except ValueError as e:
+            outcome = f"rejected ({type(e).__name__})"
+        print(f"{expr[:38]:<40}{outcome} in {(time.perf_counter() - t0) * 1e6:.0f} us")
+
 
-    return eval(expression)
+if __name__ == "__main__":
+    benchmark()
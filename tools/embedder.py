@@ -0,0 +1,308 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+from tools import model_registry
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+CACHE_SIZE = 1024  # query embeddings kept in the LRU
+
+# "torch" (fp32 PyTorch), "onnx" (fp32 ONNX Runtime) or "onnx-int8"
+# (ONNX Runtime with dynamic int8 quantization)
+BACKENDS = ("torch", "onnx", "onnx-int8")
+BACKEND = os.environ.get("GANIT_EMBED_BACKEND", "torch")
+
+# Exported / quantized models are cached here after the first run
+MODEL_CACHE_DIR = os.environ.get("GANIT_MODEL_DIR", "models")
+# Quantization target: "avx2" runs on any modern x86; also "avx512", "avx512_vnni", "arm64"
+QUANT_CONFIG = os.environ.get("GANIT_QUANT_CONFIG", "avx2")
+
+_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+# Micro-batching of concurrent single-query encodes: a batch is run once
+# MAX_BATCH requests are queued or the oldest has waited MAX_WAIT_MS
+MAX_WAIT_MS = float(os.environ.get("GANIT_EMBED_MAX_WAIT_MS", "5"))
+MAX_BATCH = int(os.environ.get("GANIT_EMBED_MAX_BATCH", "32"))
+
+_QUEUE = None
+_QUEUE_LOCK = threading.Lock()
+
+
+def load_model(backend: str = BACKEND):
+    """
+    Load MiniLM on the given backend. ONNX variants are exported (and
+    quantized) once and then loaded from MODEL_CACHE_DIR.
+    """
+    # Imported here: torch alone takes seconds to import
+    from sentence_transformers import SentenceTransformer
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Choose from {BACKENDS}")
+
+    if backend == "torch":
+        return SentenceTransformer(MODEL_NAME, device="cpu")
+
+    onnx_dir = os.path.join(MODEL_CACHE_DIR, f"{MODEL_NAME}-onnx")
+    if not os.path.exists(os.path.join(onnx_dir, "onnx", "model.onnx")):
+        SentenceTransformer(MODEL_NAME, backend="onnx", device="cpu").save_pretrained(onnx_dir)
+
+    if backend == "onnx":
+        return SentenceTransformer(onnx_dir, backend="onnx", device="cpu")
+
+    quantized_file = f"model_qint8_{QUANT_CONFIG}.onnx"
+    if not os.path.exists(os.path.join(onnx_dir, "onnx", quantized_file)):
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        export_dynamic_quantized_onnx_model(
+            SentenceTransformer(onnx_dir, backend="onnx", device="cpu"),
+            QUANT_CONFIG,
+            onnx_dir
+        )
+
+    return SentenceTransformer(
+        onnx_dir,
+        backend="onnx",
+        device="cpu",
+        model_kwargs={"file_name": os.path.join("onnx", quantized_file)}
+    )
+
+
+model_registry.register("embedder", lambda: load_model(BACKEND))
+
+
+def get_model():
+    """
+    Single process-wide MiniLM instance on the configured BACKEND,
+    loaded on first use.
+    """
+    return model_registry.get("embedder")
+
+
+def dimension() -> int:
+    return get_model().get_sentence_embedding_dimension()
+
+
+def vector_key() -> str:
+    """
+    Identifies the vectors this configuration produces, for stored
+    embeddings (KB index, embedding cache, solved memory): switching the
+    backend or quantization target invalidates them. Plain MODEL_NAME for
+    torch, which is what builds before backends were selectable used.
+    """
+    if BACKEND == "torch":
+        return MODEL_NAME
+    if BACKEND == "onnx-int8":
+        return f"{MODEL_NAME}:{BACKEND}:{QUANT_CONFIG}"
+    return f"{MODEL_NAME}:{BACKEND}"
+
+
+def normalize_text(text: str) -> str:
+    # MiniLM's tokenizer is uncased and whitespace-insensitive
+    return " ".join(text.split()).lower()
+
+
+class BatchQueue:
+    """
+    Collects encode requests from concurrent sessions and runs them as one
+    batched forward pass. Each caller blocks on its own Future.
+    """
+
+    def __init__(self, max_wait_ms: float = MAX_WAIT_MS, max_batch: int = MAX_BATCH):
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch = max_batch
+
+        self._pending = []  # (text, future, enqueued_at)
+        self._cond = threading.Condition()
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        with self._cond:
+            self._pending.append((text, future, time.perf_counter()))
+            self._cond.notify()
+        return future
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+
+            deadline = self._pending[0][2] + self.max_wait
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            return batch
+
+    def _worker(self):
+        while True:
+            batch = self._next_batch()
+            started = time.perf_counter()
+
+            futures = [future for _, future, _ in batch if future.set_running_or_notify_cancel()]
+            texts = [text for text, future, _ in batch if future in futures]
+            if not texts:
+                continue
+
+            try:
+                embs = np.asarray(get_model().encode(texts, batch_size=len(texts)), dtype="float32")
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for future, emb in zip(futures, embs):
+                future.set_result(emb)
+
+            waits = [started - enqueued for _, _, enqueued in batch]
+            with self._stats_lock:
+                self._batches += 1
+                self._requests += len(batch)
+                self._wait_total += sum(waits)
+                self._wait_max = max(self._wait_max, max(waits))
+
+    def metrics(self) -> dict:
+        """
+        Batch fill rate (mean batch size / max_batch) and queueing delay.
+        """
+        with self._stats_lock:
+            batches, requests = self._batches, self._requests
+            mean_batch = requests / batches if batches else 0.0
+            return {
+                "batches": batches,
+                "requests": requests,
+                "mean_batch_size": mean_batch,
+                "fill_rate": mean_batch / self.max_batch,
+                "mean_queue_ms": self._wait_total / requests * 1000 if requests else 0.0,
+                "max_queue_ms": self._wait_max * 1000,
+            }
+
+
+def get_queue() -> BatchQueue:
+    global _QUEUE
+    if _QUEUE is None:
+        with _QUEUE_LOCK:
+            if _QUEUE is None:
+                _QUEUE = BatchQueue()
+    return _QUEUE
+
+
+def queue_metrics() -> dict:
+    return get_queue().metrics() if _QUEUE is not None else {}
+
+
+def encode(text: str) -> np.ndarray:
+    """
+    Embed a single query, served from the LRU cache when seen before.
+    Misses from concurrent callers are batched through the shared queue.
+    The returned array is shared with the cache and must not be mutated.
+    """
+    key = normalize_text(text)
+
+    with _CACHE_LOCK:
+        if key in _CACHE:
+            _CACHE.move_to_end(key)
+            return _CACHE[key]
+
+    if MAX_BATCH > 1:
+        emb = get_queue().submit(key).result()
+    else:
+        emb = np.asarray(get_model().encode(key), dtype="float32")
+    emb.setflags(write=False)
+
+    with _CACHE_LOCK:
+        _CACHE[key] = emb
+        _CACHE.move_to_end(key)
+        while len(_CACHE) > CACHE_SIZE:
+            _CACHE.popitem(last=False)
+
+    return emb
+
+
+def encode_batch(texts, batch_size: int = 32) -> np.ndarray:
+    """
+    Embed many documents in batched forward passes. Bypasses the query cache.
+    """
+    if not texts:
+        return np.zeros((0, dimension()), dtype="float32")
+
+    embs = get_model().encode(list(texts), batch_size=batch_size)
+    return np.asarray(embs, dtype="float32")
+
+
+def clear_cache():
+    with _CACHE_LOCK:
+        _CACHE.clear()
+
+
+def _rss_mb() -> float:
+    import psutil
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def parity_check(texts, backends=("onnx", "onnx-int8")):
+    """
+    Compare each backend against fp32 PyTorch on `texts`: cosine drift of
+    the embeddings, single-query latency, and the RSS added by loading it.
+    """
+    def profile(backend):
+        rss_before = _rss_mb()
+        model = load_model(backend)
+        rss_added = _rss_mb() - rss_before
+
+        embs = np.asarray(model.encode(list(texts)), dtype="float32")
+
+        latencies = []
+        for text in texts:
+            t0 = time.perf_counter()
+            model.encode(text)
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+        return embs, np.median(latencies), rss_added
+
+    reference, ref_latency, ref_rss = profile("torch")
+    reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+
+    print(f"{len(texts)} texts")
+    print(f"{'backend':<12}{'mean cos':>10}{'min cos':>10}{'p50 ms':>10}{'+RSS MB':>10}")
+    print(f"{'torch':<12}{1.0:>10.4f}{1.0:>10.4f}{ref_latency:>10.2f}{ref_rss:>10.0f}")
+
+    for backend in backends:
+        embs, latency, rss = profile(backend)
+        embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+        cosines = np.sum(embs * reference, axis=1)
+        print(f"{backend:<12}{cosines.mean():>10.4f}{cosines.min():>10.4f}{latency:>10.2f}{rss:>10.0f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Embedding backend parity check against fp32 PyTorch")
+    parser.add_argument("--texts", help="file with one text per line (defaults to the KB chunks)")
+    parser.add_argument("--backends", nargs="+", default=["onnx", "onnx-int8"], choices=BACKENDS[1:])
+    args = parser.parse_args()
+
+    if args.texts:
+        with open(args.texts, "r") as f:
+            sample = [line.strip() for line in f if line.strip()]
+    else:
+        from rag.ingest import iter_files, list_kb_files
+        sample = [c["text"] for loaded in iter_files(list_kb_files()) for c in loaded["chunks"]]
+
+    parity_check(sample, args.backends)
@@ -0,0 +1,137 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+CACHE_DIR = os.environ.get("GANIT_MEDIA_CACHE_DIR", "cache/media")
+MEMORY_ITEMS = 256                 # results kept in-process per cache
+DISK_BYTES = 64 * 1024 * 1024      # on-disk budget per cache
+
+
+def content_key(data: bytes, config: dict) -> str:
+    """
+    sha256 of the media bytes and the engine configuration, so the same
+    upload processed with different settings is cached separately.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps(config, sort_keys=True).encode("utf-8"))
+    h.update(b"\0")
+    h.update(data)
+    return h.hexdigest()
+
+
+class MediaCache:
+    """
+    Two-tier cache of OCR / ASR result dicts keyed by content hash: an
+    in-process LRU in front of a directory of JSON files. The disk tier
+    evicts least recently used entries (by mtime) beyond `disk_bytes`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        config: dict,
+        memory_items: int = MEMORY_ITEMS,
+        disk_bytes: int = DISK_BYTES,
+        cache_dir: str = CACHE_DIR
+    ):
+        self.config = config
+        self.memory_items = memory_items
+        self.disk_bytes = disk_bytes
+        self.dir = os.path.join(cache_dir, name)
+        os.makedirs(self.dir, exist_ok=True)
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._disk_used = sum(entry.stat().st_size for entry in os.scandir(self.dir) if entry.is_file())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.dir, key + ".json")
+
+    def _remember(self, key: str, result: dict):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._counts["memory_hits"] += 1
+                return self._memory[key]
+
+        try:
+            with open(self._path(key), "r") as f:
+                result = json.load(f)
+            os.utime(self._path(key))  # mark as recently used
+        except (FileNotFoundError, json.JSONDecodeError):
+            with self._lock:
+                self._counts["misses"] += 1
+            return None
+
+        with self._lock:
+            self._counts["disk_hits"] += 1
+            self._remember(key, result)
+        return result
+
+    def put(self, key: str, result: dict):
+        data = json.dumps(result).encode("utf-8")
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._remember(key, result)
+            self._disk_used += len(data)
+            if self._disk_used > self.disk_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(
+            (entry for entry in os.scandir(self.dir) if entry.name.endswith(".json")),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        self._disk_used = sum(entry.stat().st_size for entry in entries)
+
+        for entry in entries:
+            if self._disk_used <= self.disk_bytes:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+            self._disk_used -= size
+
+    def get_or_compute(self, data: bytes, compute):
+        """
+        Cached result for `data`, or `compute()` stored under its hash.
+        """
+        key = content_key(data, self.config)
+        result = self.get(key)
+        if result is None:
+            result = compute()
+            self.put(key, result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+            lookups = sum(counts.values())
+            counts["hit_rate"] = (counts["memory_hits"] + counts["disk_hits"]) / lookups if lookups else 0.0
+            counts["memory_items"] = len(self._memory)
+            counts["disk_bytes"] = self._disk_used
+            return counts
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            for entry in os.scandir(self.dir):
+                if entry.name.endswith(".json"):
+                    os.remove(entry.path)
+            self._disk_used = 0
@@ -0,0 +1,91 @@
+import os
+import time
+import threading
+
+# Set GANIT_WARMUP=0 to load models only on first use
+WARMUP_ENABLED = os.environ.get("GANIT_WARMUP", "1") != "0"
+
+_LOADERS = {}
+_MODELS = {}
+_LOCKS = {}
+_STATS = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def _rss_mb() -> float:
+    try:
+        import psutil
+    except ImportError:
+        return 0.0
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def register(name: str, loader):
+    """
+    Declare a model without loading it. `loader()` must import whatever
+    heavy libraries it needs itself, so registering costs nothing.
+    """
+    with _REGISTRY_LOCK:
+        _LOADERS[name] = loader
+        _LOCKS.setdefault(name, threading.Lock())
+
+
+def get(name: str):
+    """
+    The loaded model, constructing it on first use. Concurrent callers
+    (including a warm-up thread) wait for the same single load.
+    """
+    model = _MODELS.get(name)
+    if model is not None:
+        return model
+
+    with _LOCKS[name]:
+        if name not in _MODELS:
+            rss_before = _rss_mb()
+            t0 = time.perf_counter()
+            _MODELS[name] = _LOADERS[name]()
+            _STATS[name] = {
+                "load_seconds": round(time.perf_counter() - t0, 3),
+                # Approximate when several models load at the same time
+                "rss_mb": round(_rss_mb() - rss_before, 1),
+                "thread": threading.current_thread().name,
+            }
+    return _MODELS[name]
+
+
+def is_loaded(name: str) -> bool:
+    return name in _MODELS
+
+
+def warm_up(*names):
+    """
+    Load the named models in a background thread, skipping loaded ones.
+    Returns the thread, or None when there is nothing to do.
+    """
+    todo = [name for name in names if name in _LOADERS and name not in _MODELS]
+    if not WARMUP_ENABLED or not todo:
+        return None
+
+    def load_all():
+        for name in todo:
+            try:
+                get(name)
+            except Exception as e:
+                print(f"Warm-up of '{name}' failed: {e}")
+
+    thread = threading.Thread(target=load_all, name="warmup-" + "-".join(todo), daemon=True)
+    thread.start()
+    return thread
+
+
+def stats() -> dict:
+    """
+    Per-model load time and RSS growth, for the models loaded so far.
+    """
+    return {name: dict(_STATS[name]) for name in _STATS}
+
+
+def unload(name: str):
+    with _LOCKS[name]:
+        _MODELS.pop(name, None)
+        _STATS.pop(name, None)
@@ -1,43 +1,281 @@
-from paddleocr import PaddleOCR
 import cv2
 import numpy as np
 from PIL import Image
 import os
+import time
+import queue
+import threading
+from contextlib import contextmanager
+
+from tools import model_registry
+from tools.media_cache import MediaCache
 
 os.environ["FLAGS_allocator_strategy"] = "auto_growth"
 
-# Initialize OCR engines once (performance)
-PRINTED_OCR = PaddleOCR(use_angle_cls=True, lang="en")
-HANDWRITTEN_OCR = PaddleOCR(
-    use_angle_cls=True,
-    lang="en",
-    det_db_box_thresh=0.3,
-    det_db_unclip_ratio=2.0
-)
+# One PaddleOCR pipeline (detection + recognition weights) serves both
+# modes: printed and handwritten differ only in detection post-processing,
+# which PaddleOCR 3.x accepts per call. None keeps the model default.
+DETECTION_PARAMS = {
+    "printed": {"text_det_box_thresh": None, "text_det_unclip_ratio": None},
+    "handwritten": {"text_det_box_thresh": 0.3, "text_det_unclip_ratio": 2.0},
+}
+USE_TEXTLINE_ORIENTATION = True
+
+# Engines in the pool; predict() is not thread-safe, so concurrent
+# sessions each borrow one. Every extra engine costs a full model in RAM.
+POOL_SIZE = int(os.environ.get("GANIT_OCR_POOL_SIZE", "1"))
+
+
+_POOL_LOCK = threading.Lock()
+
 
-def detect_handwritten(image_path: str) -> bool:
+def _new_engine():
+    from paddleocr import PaddleOCR
+    return PaddleOCR(lang="en", use_textline_orientation=USE_TEXTLINE_ORIENTATION)
+
+
+def _load_pool():
+    pool = queue.Queue()
+    pool.size = POOL_SIZE
+    for _ in range(POOL_SIZE):
+        pool.put(_new_engine())
+    return pool
+
+
+def ensure_engines(count: int):
+    """
+    Grow the pool to at least `count` engines, so `count` callers can
+    recognize at the same time (e.g. worksheet pages).
+    """
+    pool = model_registry.get("ocr")
+    with _POOL_LOCK:
+        while pool.size < count:
+            pool.put(_new_engine())
+            pool.size += 1
+
+
+model_registry.register("ocr", _load_pool)
+MODEL_NAMES = ("ocr",)
+
+
+@contextmanager
+def ocr_engine():
+    pool = model_registry.get("ocr")
+    engine = pool.get()
+    try:
+        yield engine
+    finally:
+        pool.put(engine)
+
+
+# Preprocessing: analysis runs on a thumbnail; the OCR input is cropped
+# to the text region and scaled so text lines are about TARGET_TEXT_HEIGHT
+# pixels tall (never upscaled, never larger than MAX_SIDE)
+THUMBNAIL_SIDE = 640
+TARGET_TEXT_HEIGHT = 40
+MAX_SIDE = 2048
+CROP_MARGIN = 0.03  # of the image size, around the detected text
+
+# Cascade: a cheap pass (no orientation model, smaller detection input)
+# is kept when its mean confidence reaches CASCADE_THRESHOLD. The limit
+# type must be "max" for the side length to shrink large inputs; with
+# "min" it only enlarges small ones
+CASCADE_THRESHOLD = 0.85
+FAST_PARAMS = {
+    "use_textline_orientation": False,
+    "text_det_limit_side_len": 736,
+    "text_det_limit_type": "max",
+}
+FULL_PARAMS = {"use_textline_orientation": USE_TEXTLINE_ORIENTATION}
+
+HANDWRITING_EDGE_DENSITY = 0.08
+
+# Cached results are only valid for this engine configuration
+OCR_CONFIG = {
+    "engine": "paddleocr",
+    "lang": "en",
+    "detection": DETECTION_PARAMS,
+    "handwriting_edge_density": HANDWRITING_EDGE_DENSITY,
+    "preprocess": [THUMBNAIL_SIDE, TARGET_TEXT_HEIGHT, MAX_SIDE, CROP_MARGIN],
+    "cascade": [CASCADE_THRESHOLD, FAST_PARAMS, FULL_PARAMS],
+}
+CACHE = MediaCache("ocr", OCR_CONFIG)
+
+def media_bytes(image) -> bytes:
+    """
+    Raw bytes identifying an image given as a path, encoded bytes or a
+    decoded array (shape and dtype included, so arrays hash distinctly).
+    """
+    if isinstance(image, np.ndarray):
+        return f"{image.shape}{image.dtype}".encode("utf-8") + np.ascontiguousarray(image).tobytes()
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(image)
+    with open(image, "rb") as f:
+        return f.read()
+
+
+def decode_image(image) -> np.ndarray:
+    """
+    BGR uint8 array from a path, encoded bytes (PNG/JPEG) or an array.
+    Grayscale and RGBA arrays are converted to 3-channel BGR.
+    """
+    if isinstance(image, np.ndarray):
+        img = image
+    else:
+        data = media_bytes(image)
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("Could not decode image")
+
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    elif img.shape[2] == 4:
+        img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+    return img
+
+
+def thumbnail(img: np.ndarray, side: int = THUMBNAIL_SIDE):
+    """
+    Grayscale copy whose longer side is at most `side`, and its scale.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    scale = min(1.0, side / max(gray.shape[:2]))
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray, scale
+
+
+def detect_handwritten(image) -> bool:
     """
     Heuristic-based handwriting detection.
     Uses edge density + noise patterns.
+    Accepts a path, encoded bytes, a BGR array or a grayscale thumbnail.
     """
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    img = image if isinstance(image, np.ndarray) and image.ndim == 2 else \
+        cv2.cvtColor(decode_image(image), cv2.COLOR_BGR2GRAY)
     edges = cv2.Canny(img, 50, 150)
 
     edge_density = np.sum(edges > 0) / edges.size
 
     # Handwritten text generally has irregular strokes
-    return edge_density > 0.08
+    return edge_density > HANDWRITING_EDGE_DENSITY
+
+
+def preprocess(img: np.ndarray, thumb: np.ndarray, thumb_scale: float) -> np.ndarray:
+    """
+    Crop `img` to the text region found on its thumbnail and downsize it
+    so text lines are about TARGET_TEXT_HEIGHT pixels tall.
+    """
+    ink = cv2.adaptiveThreshold(
+        thumb, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 25, 15
+    )
+    count, _, stats, _ = cv2.connectedComponentsWithStats(ink)
 
+    # Glyph-sized components: drop specks and page-sized blobs
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    glyphs = stats[1:][(areas >= 4) & (heights < thumb.shape[0] / 4)]
+    if len(glyphs) == 0:
+        return img
 
-def run_ocr(image_path: str) -> dict:
-    is_handwritten = detect_handwritten(image_path)
-    ocr_engine = HANDWRITTEN_OCR if is_handwritten else PRINTED_OCR
+    h, w = img.shape[:2]
+    x0 = glyphs[:, cv2.CC_STAT_LEFT].min()
+    y0 = glyphs[:, cv2.CC_STAT_TOP].min()
+    x1 = (glyphs[:, cv2.CC_STAT_LEFT] + glyphs[:, cv2.CC_STAT_WIDTH]).max()
+    y1 = (glyphs[:, cv2.CC_STAT_TOP] + glyphs[:, cv2.CC_STAT_HEIGHT]).max()
 
-    result = ocr_engine.ocr(image_path)
+    margin_x, margin_y = int(CROP_MARGIN * w), int(CROP_MARGIN * h)
+    x0 = max(0, int(x0 / thumb_scale) - margin_x)
+    y0 = max(0, int(y0 / thumb_scale) - margin_y)
+    x1 = min(w, int(x1 / thumb_scale) + margin_x)
+    y1 = min(h, int(y1 / thumb_scale) + margin_y)
+    img = img[y0:y1, x0:x1]
 
+    text_height = np.median(glyphs[:, cv2.CC_STAT_HEIGHT]) / thumb_scale
+    scale = min(1.0, TARGET_TEXT_HEIGHT / text_height, MAX_SIDE / max(img.shape[:2]))
+    if scale < 1.0:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    return np.ascontiguousarray(img)
+
+
+def run_ocr(image) -> dict:
+    """
+    OCR an image given as a path, encoded bytes or a decoded BGR array.
+    Results are cached by content hash, so the same image (re-uploaded
+    or seen again on a rerun) is only recognized once.
+    """
+    data = media_bytes(image)
+    return CACHE.get_or_compute(data, lambda: _run_ocr(image if isinstance(image, np.ndarray) else data))
+
+
+def _recognize(img: np.ndarray, mode: str, params: dict):
+    with ocr_engine() as engine:
+        result = engine.predict(img, **DETECTION_PARAMS[mode], **params)
+
+    extracted_text, confidences = parse_ocr_result(result)
+    avg_confidence = (
+        sum(confidences) / len(confidences)
+        if confidences else 0.0
+    )
+    return extracted_text, avg_confidence
+
+
+def _run_ocr(image) -> dict:
+    timings = {}
+    t0 = time.perf_counter()
+
+    def lap(name):
+        nonlocal t0
+        now = time.perf_counter()
+        timings[name] = round((now - t0) * 1000, 2)
+        t0 = now
+
+    # Decode once; thumbnail and OCR input are derived from this array
+    img = decode_image(image)
+    lap("decode")
+
+    thumb, thumb_scale = thumbnail(img)
+    is_handwritten = detect_handwritten(thumb)
+    mode = "handwritten" if is_handwritten else "printed"
+    lap("detect_handwriting")
+
+    img = preprocess(img, thumb, thumb_scale)
+    lap("preprocess")
+
+    extracted_text, avg_confidence = _recognize(img, mode, FAST_PARAMS)
+    lap("ocr_fast")
+    stage = "fast"
+
+    if avg_confidence < CASCADE_THRESHOLD:
+        extracted_text, avg_confidence = _recognize(img, mode, FULL_PARAMS)
+        lap("ocr_full")
+        stage = "full"
+
+    return {
+        "text": "\n".join(extracted_text),
+        "confidence": round(avg_confidence, 3),
+        "ocr_type": mode,
+        "ocr_stage": stage,
+        "input_size": list(img.shape[:2]),
+        "timings_ms": timings
+    }
+
+
+def parse_ocr_result(result):
+    """
+    (texts, confidences) from PaddleOCR output: 3.x result objects with
+    `rec_texts` / `rec_scores`, or 2.x [[box, (text, confidence)], ...].
+    """
     extracted_text = []
     confidences = []
 
+    if result and isinstance(result[0], dict) and "rec_texts" in result[0]:
+        for page in result:
+            extracted_text.extend(page["rec_texts"])
+            confidences.extend(float(score) for score in page["rec_scores"])
+        return extracted_text, confidences
+
     if result and result[0]:
         for line in result[0]:
             try:
@@ -61,13 +299,4 @@ def run_ocr(image_path: str) -> dict:
             except Exception:
                 continue  # skip corrupted lines safely
 
-    avg_confidence = (
-        sum(confidences) / len(confidences)
-        if confidences else 0.0
-    )
-
-    return {
-        "text": "\n".join(extracted_text),
-        "confidence": round(avg_confidence, 3),
-        "ocr_type": "handwritten" if is_handwritten else "printed"
-    }
+    return extracted_text, confidences
@@ -0,0 +1,217 @@
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from tools.ocr import ensure_engines, run_ocr
+
+# 72 dpi * RENDER_SCALE; ~200 dpi keeps printed worksheets legible
+RENDER_SCALE = 200 / 72
+
+OCR_WORKERS = 2      # pages being recognized at once; one OCR engine each
+SOLVE_WORKERS = 4    # problems being solved at once
+
+# "1.", "2)", "Q3.", "Q 4:", "(5)", "Problem 6:" at the start of a line
+PROBLEM_NUMBER_RE = re.compile(
+    # A "." must not be followed by a digit, or "2.5x + 3" would start problem 2
+    r"^\s*(?:(?:q|question|problem|ex|exercise)\s*\.?\s*)?\(?(\d{1,3})\s*(?:\.(?!\d)|[):])\s*",
+    re.IGNORECASE
+)
+
+
+def is_pdf(data: bytes) -> bool:
+    return data[:5] == b"%PDF-"
+
+
+def iter_pages(sources, scale: float = RENDER_SCALE):
+    """
+    Yield page images from a list of uploads: every page of each PDF,
+    rendered with pypdfium2, and images (bytes or arrays) as they are.
+    """
+    for source in sources:
+        if isinstance(source, (bytes, bytearray)) and is_pdf(source):
+            import pypdfium2 as pdfium
+
+            # pdfium is not thread-safe, so pages are rendered here, in
+            # order, while recognition of earlier pages runs on the pool
+            pdf = pdfium.PdfDocument(bytes(source))
+            try:
+                for i in range(len(pdf)):
+                    page = pdf[i]
+                    yield page.render(scale=scale).to_numpy()
+                    page.close()
+            finally:
+                pdf.close()
+        else:
+            yield source
+
+
+def split_problems(text: str):
+    """
+    [(number, text)] from OCR lines. A numbered line starts a problem;
+    unnumbered lines continue the current one. Text before the first
+    number (titles, instructions) is returned with number None.
+    """
+    problems = []
+    number, lines = None, []
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        match = PROBLEM_NUMBER_RE.match(line)
+        if match:
+            if lines:
+                problems.append((number, " ".join(lines)))
+            number, lines = int(match.group(1)), [line[match.end():]]
+        else:
+            lines.append(line)
+
+    if lines:
+        problems.append((number, " ".join(lines)))
+
+    return problems
+
+
+def solve_worksheet(pipeline, sources, ocr_workers: int = OCR_WORKERS, solve_workers: int = SOLVE_WORKERS):
+    """
+    OCR every page on a bounded pool and solve each numbered problem as
+    soon as its text is complete. Yields events as they happen:
+
+      {"type": "page", "page", "ocr"}
+      {"type": "problem", "number", "page", "text", "result"}
+      {"type": "summary", "pages", "problems", "seconds", "pages_per_sec", "problems_per_sec"}
+
+    Problem events arrive in completion order, not worksheet order.
+    """
+    t0 = time.perf_counter()
+    pages = iter(enumerate(iter_pages(sources), 1))
+
+    # A PaddleOCR engine serves one call at a time, so parallel pages need
+    # as many engines (each a full model in memory)
+    ensure_engines(ocr_workers)
+
+    ocr_pool = ThreadPoolExecutor(max_workers=ocr_workers, thread_name_prefix="worksheet-ocr")
+    solve_pool = ThreadPoolExecutor(max_workers=solve_workers, thread_name_prefix="worksheet-solve")
+
+    ocr_running = {}
+    solving = {}
+    recognized = {}      # page number -> OCR result, until its turn comes
+    next_page = 1
+    carry = None         # last problem so far; it may continue on the next page
+    preamble = []        # text before the first number (titles, instructions)
+    numbered = False
+    counts = {"pages": 0, "problems": 0}
+    pages_done_at = t0
+
+    def submit_page():
+        try:
+            page_number, image = next(pages)
+        except StopIteration:
+            return False
+        ocr_running[ocr_pool.submit(run_ocr, image)] = page_number
+        return True
+
+    def submit_problem(problem):
+        page_number, number, text = problem
+        future = solve_pool.submit(pipeline.run, text, store=False)
+        solving[future] = (page_number, number, text)
+
+    try:
+        # Render ahead only as far as the OCR pool can take
+        more_pages = True
+        while more_pages and len(ocr_running) < ocr_workers:
+            more_pages = submit_page()
+
+        while ocr_running or solving:
+            done, _ = wait(list(ocr_running) + list(solving), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future in ocr_running:
+                    page_number = ocr_running.pop(future)
+                    try:
+                        recognized[page_number] = future.result()
+                    except Exception as e:
+                        recognized[page_number] = {"text": "", "confidence": 0.0, "error": repr(e)}
+                    if more_pages:
+                        more_pages = submit_page()
+                    continue
+
+                page_number, number, text = solving.pop(future)
+                counts["problems"] += 1
+                yield {
+                    "type": "problem",
+                    "number": number,
+                    "page": page_number,
+                    "text": text,
+                    "result": future.result()
+                }
+
+            # Split pages strictly in order, so a problem running across a
+            # page break is joined before it is solved
+            while next_page in recognized:
+                ocr = recognized.pop(next_page)
+                counts["pages"] += 1
+                pages_done_at = time.perf_counter()
+                yield {"type": "page", "page": next_page, "ocr": ocr}
+
+                for number, text in split_problems(ocr["text"]):
+                    if number is None:
+                        if carry is not None:
+                            carry = (carry[0], carry[1], carry[2] + " " + text)
+                        else:
+                            preamble.append((next_page, text))
+                        continue
+
+                    numbered = True
+                    if carry is not None:
+                        submit_problem(carry)
+                    carry = (next_page, number, text)
+
+                next_page += 1
+
+            if not more_pages and not ocr_running and not recognized:
+                # An unnumbered upload (one photographed problem) is solved whole
+                if not numbered and preamble:
+                    carry = (preamble[0][0], None, " ".join(text for _, text in preamble))
+                    preamble = []
+                if carry is not None:
+                    submit_problem(carry)
+                    carry = None
+
+    finally:
+        ocr_pool.shutdown(wait=False, cancel_futures=True)
+        solve_pool.shutdown(wait=False, cancel_futures=True)
+
+    seconds = time.perf_counter() - t0
+    yield {
+        "type": "summary",
+        "pages": counts["pages"],
+        "problems": counts["problems"],
+        "seconds": round(seconds, 2),
+        "pages_per_sec": round(counts["pages"] / max(pages_done_at - t0, 1e-9), 2),
+        "problems_per_sec": round(counts["problems"] / max(seconds, 1e-9), 2)
+    }
+
+
+if __name__ == "__main__":
+    import json
+    import argparse
+
+    from pipeline import GanitPipeline
+
+    parser = argparse.ArgumentParser(description="Solve every numbered problem in worksheet PDFs or images")
+    parser.add_argument("files", nargs="+", help="PDF or image files, in page order")
+    parser.add_argument("--ocr-workers", type=int, default=OCR_WORKERS)
+    parser.add_argument("--solve-workers", type=int, default=SOLVE_WORKERS)
+    args = parser.parse_args()
+
+    uploads = []
+    for path in args.files:
+        with open(path, "rb") as f:
+            uploads.append(f.read())
+
+    for event in solve_worksheet(GanitPipeline(), uploads, args.ocr_workers, args.solve_workers):
+        if event["type"] == "page":
+            continue
+        print(json.dumps(event))